@@ -0,0 +1,112 @@
+# Выгрузка, восстановление и резервная копия состояния бота:
+#   python -m victim_bot export [-o state.ndjson.gz] [--chat ID ...]
+#   python -m victim_bot import state.ndjson.gz [--chat ID ...]
+#   python -m victim_bot backup DEST
+# Формат выгрузки — NDJSON: строка-заголовок, дальше по одной строке на чат
+# (см. StorageBackend.export_chat), потом история жеребьёвок — по строке
+# {"draw": {...}} на запись (StorageBackend.iter_draws). Чаты и записи
+# пишутся и читаются по одной, так что ни файл, ни история любого размера
+# не держатся в памяти целиком.
+import argparse
+import asyncio
+import contextlib
+import gzip
+import itertools
+import json
+import logging
+import sys
+import time
+
+FORMAT = "victim_bot-state"
+FORMAT_VERSION = 2
+
+def open_stream(path, mode):
+    if path in (None, "-"):
+        stream = sys.stdout if mode == "w" else sys.stdin
+        return contextlib.nullcontext(stream)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+# =============== ВЫГРУЗКА ==================
+def export_state(backend, out, chat_ids=None):
+    # Все чаты и история читаются из одного среза хранилища (read_snapshot)
+    count = 0
+    with backend.read_snapshot():
+        header = {"format": FORMAT, "version": FORMAT_VERSION, "backend": backend.name, "created": time.time()}
+        out.write(json.dumps(header) + "\n")
+        for chat_id in (chat_ids if chat_ids else backend.iter_chats()):
+            out.write(json.dumps(backend.export_chat(chat_id), ensure_ascii=False, separators=(",", ":")) + "\n")
+            count += 1
+        for draw in backend.iter_draws(chat_ids):
+            out.write(json.dumps({"draw": draw}, ensure_ascii=False, separators=(",", ":")) + "\n")
+    return count
+
+# =============== ВОССТАНОВЛЕНИЕ ==================
+def read_records(lines):
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+def import_state(backend, lines, chat_ids=None, owns=None):
+    # Состояние каждого чата заменяется целиком, как только прочитана его
+    # строка; затем история восстановленных чатов заменяется одним проходом
+    # по строкам жеребьёвок (replace_draws) — в обоих бэкендах одинаково.
+    # Прерванное восстановление можно просто запустить ещё раз.
+    # owns(chat_id) — принадлежит ли чат этому шарду: чужие пропускаются
+    records = read_records(lines)
+    header = next(records, {})
+    if header.get("format") != FORMAT or header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Неизвестный формат выгрузки: {header}")
+    wanted = set(chat_ids or ())
+    restored = set()
+    first_draw = None
+    for record in records:
+        if "draw" in record:
+            first_draw = record
+            break
+        if wanted and record["chat_id"] not in wanted:
+            continue
+        if owns is not None and not owns(record["chat_id"]):
+            continue
+        backend.restore_chat(record)
+        restored.add(record["chat_id"])
+    if restored:
+        draw_records = itertools.chain([first_draw], records) if first_draw else ()
+        backend.replace_draws(sorted(restored), (r["draw"] for r in draw_records if r["draw"]["chat_id"] in restored))
+    return len(restored)
+
+# =============== CLI ==================
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m victim_bot", description="Выгрузка и восстановление состояния бота")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="выгрузить состояние в NDJSON (по чату на строку)")
+    export.add_argument("-o", "--output", default="-", help="файл (.gz — со сжатием), по умолчанию stdout")
+    export.add_argument("--chat", type=int, action="append", help="только этот чат (можно несколько раз)")
+    restore = commands.add_parser("import", help="восстановить чаты из выгрузки")
+    restore.add_argument("input", nargs="?", default="-", help="файл выгрузки, по умолчанию stdin")
+    restore.add_argument("--chat", type=int, action="append", help="только этот чат (можно несколько раз)")
+    backup = commands.add_parser("backup", help="согласованная копия хранилища (файл SQLite или папка с JSON)")
+    backup.add_argument("dest")
+    return parser
+
+def main(argv, backend, owns=None):
+    args = build_parser().parse_args(argv)
+    backend.load()
+    try:
+        if args.command == "export":
+            with open_stream(args.output, "w") as out:
+                count = export_state(backend, out, args.chat)
+            logging.info(f"Выгружено чатов: {count}")
+        elif args.command == "import":
+            with open_stream(args.input, "r") as lines:
+                count = import_state(backend, lines, args.chat, owns)
+            logging.info(f"Восстановлено чатов: {count}")
+        else:
+            copied = backend.backup(args.dest)
+            logging.info(f"Резервная копия: {', '.join(copied)}")
+    finally:
+        # export и backup работают рядом с ботом и только читают: то, что
+        # изменилось в памяти при чтении, на диск не пишем
+        asyncio.run(backend.close(flush=args.command == "import"))
+    return 0
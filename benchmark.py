@@ -0,0 +1,211 @@
+# Нагрузочный прогон бота без сети: синтетические апдейты идут через
+# dp.feed_update, Bot API подменён FakeTelegram. Пример:
+#   python benchmark.py --chats 200 --users 50 --output bench.json --compare old.json
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from fake_telegram import FakeTelegram, UpdateFactory
+from sender import SendQueue
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+def summarize(latencies, wall):
+    samples = sorted(latencies)
+    return {
+        "count": len(samples),
+        "throughput_per_s": round(len(samples) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3) if samples else 0.0,
+    }
+
+async def timed(func, *args):
+    started = time.perf_counter()
+    await func(*args)
+    return time.perf_counter() - started
+
+async def run_scenario(per_chat_jobs):
+    # Чаты обрабатываются параллельно, внутри чата — по очереди
+    latencies = []
+
+    async def run_chat(jobs):
+        for func, *args in jobs:
+            latencies.append(await timed(func, *args))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_chat(jobs) for jobs in per_chat_jobs))
+    return summarize(latencies, time.perf_counter() - started)
+
+# =============== СЦЕНАРИИ ==================
+async def run_benchmark(vb, chats=50, users=20, messages=2, member_latency=0.005, flood_rate=0.0):
+    # vb — импортированный модуль victim_bot
+    from aiogram import Bot, types
+    from aiogram.client.default import DefaultBotProperties
+
+    session = FakeTelegram(member_latency=member_latency, flood_rate=flood_rate)
+    bot = Bot(token="42:BENCHMARK", session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    bot.session.middleware(vb.api_metrics_middleware)
+    vb.bot = bot
+    factory = UpdateFactory()
+    chat_ids = [-1000000000000 - i for i in range(chats)]
+
+    def feed(update):
+        return vb.dp.feed_update(bot, types.Update.model_validate(update))
+
+    results = {}
+    results["mark_user_as_active"] = await run_scenario([
+        [(feed, factory.message(chat_id, user_id, f"сообщение {n}"))
+         for n in range(messages) for user_id in range(1, users + 1)]
+        for chat_id in chat_ids
+    ])
+    results["victim"] = await run_scenario([
+        [(feed, factory.message(chat_id, 1, "/victim"))] for chat_id in chat_ids
+    ])
+    # /statistics с холодным кэшем упоминаний — все обращения к get_chat_member
+    vb.mention_cache.clear()
+    for chat_id in chat_ids:
+        for user_id in range(1, users + 1):
+            vb.increment_stat(chat_id, user_id)
+    results["statistics"] = await run_scenario([
+        [(feed, factory.message(chat_id, 1, "/statistics"))] for chat_id in chat_ids
+    ])
+
+    # Такт планировщика: все чаты просрочены (разнесены по окну джиттера)
+    # и разыгрываются одним проходом через пул планировщика
+    for chat_id in chat_ids:
+        vb.set_setting(chat_id, "last_run_date", "2000-01-01")
+        vb.schedule_autorun(chat_id, "2000-01-01")
+    due = vb.scheduler.pop_due(time.time() + vb.config.AUTORUN_JITTER_SECONDS)
+    latencies = []
+
+    async def timed_autorun(chat_id):
+        latencies.append(await timed(vb.autorun_chat_serialized, chat_id))
+
+    started = time.perf_counter()
+    await vb.scheduler.run_batch(due, timed_autorun)
+    results["scheduler_tick"] = summarize(latencies, time.perf_counter() - started)
+
+    await vb.sender.close()
+    results["telegram_calls"] = dict(session.calls)
+    results["telegram_floods"] = session.floods
+    return results
+
+# =============== ХОЛОДНЫЙ СТАРТ ==================
+# Отдельный процесс без токена: импорт victim_bot, открытие хранилища и
+# планирование автозапуска по уже накопленному состоянию
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import victim_bot as vb
+imported = time.perf_counter()
+vb.backend.load()
+for chat_id, settings in vb.backend.iter_settings():
+    vb.schedule_autorun(chat_id, settings.get("last_run_date", ""))
+ready = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "ready_ms": (ready - started) * 1000}))
+"""
+
+def measure_startup(data_dir, backend, runs=3):
+    env = dict(os.environ, DATA_DIR=data_dir, STORAGE_BACKEND=backend)
+    env.pop("BOT_TOKEN", None)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            capture_output=True, text=True, check=True, env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        key: round(sorted(sample[key] for sample in samples)[len(samples) // 2], 1)
+        for key in ("import_ms", "ready_ms")
+    }
+
+# =============== ОТЧЁТ ==================
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def compare(current, previous):
+    lines = []
+    for name, stats in current["results"].items():
+        old = previous.get("results", {}).get(name)
+        if not isinstance(stats, dict) or not isinstance(old, dict):
+            continue
+        for key in ("throughput_per_s", "p50_ms", "p95_ms", "p99_ms", "import_ms", "ready_ms"):
+            if key in stats and old.get(key):
+                change = (stats[key] - old[key]) / old[key] * 100
+                lines.append(f"{name:20} {key:17} {old[key]:>10} -> {stats[key]:>10} ({change:+.1f}%)")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон victim_bot без обращения к Telegram")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=2, help="сообщений от каждого участника")
+    parser.add_argument("--member-latency", type=float, default=0.005, help="задержка get_chat_member, с")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля запросов, получающих 429")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--telegram-limits", action="store_true", help="не снимать лимиты очереди отправки")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    # Состояние — во временной папке, реальные данные бота не трогаем
+    data_dir = tempfile.mkdtemp(prefix="victim_bench_")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["STORAGE_BACKEND"] = args.backend
+    logging.basicConfig(level=logging.WARNING)
+
+    import victim_bot as vb
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.telegram_limits:
+        # Меряем обработчики, а не лимиты Telegram
+        vb.sender = SendQueue(global_rate=1e9, chat_per_minute=1e9, workers=vb.config.SEND_WORKERS)
+
+    results = asyncio.run(run_benchmark(
+        vb,
+        chats=args.chats,
+        users=args.users,
+        messages=args.messages,
+        member_latency=args.member_latency,
+        flood_rate=args.flood_rate,
+    ))
+    # Состояние прогона сбрасывается на диск и служит данными для замера старта
+    asyncio.run(vb.backend.close())
+    results["startup"] = measure_startup(data_dir, args.backend)
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print(compare(report, json.load(f)))
+
+if __name__ == "__main__":
+    main()
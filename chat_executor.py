@@ -0,0 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+# =============== ПОСЛЕДОВАТЕЛЬНОСТЬ ВНУТРИ ЧАТА ==================
+class ChatExecutor:
+    # Очередь на чат: всё, что выполняется под lock(chat_id), для одного чата
+    # идёт строго по одному и в порядке прихода (asyncio.Lock честный),
+    # разные чаты друг друга не ждут. Замок создаётся при первом обращении
+    # и удаляется, как только его никто не держит и не ждёт.
+
+    def __init__(self):
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def lock(self, chat_id):
+        key = str(chat_id)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def run(self, chat_id, func, *args, **kwargs):
+        async with self.lock(chat_id):
+            return await func(*args, **kwargs)
@@ -1,46 +1,129 @@
-# config.py
-
-import os
-
-# Корневая директория для json-файлов
-DATA_DIR = os.getenv("DATA_DIR") or "/data"
-
-# JSON-файлы (в /data)
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
-SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
-CUSTOM_PHRASES_FILE = os.path.join(DATA_DIR, "custom_phrases.json")
-STATS_FILE = os.path.join(DATA_DIR, "stats.json")
-
-# Временная зона
-TIMEZONE = "Europe/Moscow"
-
-# Лимиты (только из config.py!)
-DAILY_LIMIT_PER_CHAT = 1
-MIN_MEMBERS_TO_PICK = 2
-
-# Команды меню
-COMMANDS = [
-    {"command": "victim", "description": "Выбрать жертву дня"},
-    {"command": "statistics", "description": "Статистика жертв"},
-    {"command": "add_phrase", "description": "Добавить свою фразу"},
-    {"command": "del_phrase", "description": "Удалить свою фразу"},
-    {"command": "list_phrases", "description": "Показать все фразы"},
-    {"command": "help", "description": "Помощь"},
-]
-
-WELCOME_GROUP_MESSAGE = (
-    "Бот жеребьёвки активирован!\n\n"
-    "Достаточно чтобы каждый участник написал хотя бы одно сообщение или поставил реакцию, "
-    "иначе он не попадёт в жеребьёвку!\n\n"
-    "Лимит жеребьёвок в этом чате: {limit} в сутки.\n"
-    "Для помощи: /help"
-)
-HELP_MESSAGE = (
-    "<b>Команды бота:</b>\n"
-    "/victim — выбрать жертву дня\n"
-    "/statistics — статистика попаданий\n"
-    "/add_phrase текст — добавить свою фразу\n"
-    "/del_phrase номер — удалить свою фразу\n"
-    "/list_phrases — показать все фразы\n"
-)
+# config.py
+
+import os
+
+# Корневая директория для json-файлов
+DATA_DIR = os.getenv("DATA_DIR") or "/data"
+
+# Шардирование: SHARD_COUNT процессов на одном хосте, каждый обслуживает
+# чаты с shard_of(chat_id) == SHARD_INDEX (см. sharding.py) и хранит их
+# в своей папке DATA_DIR/shard-N. Автозапуск в шарде ведёт один процесс —
+# тот, что держит аренду scheduler.lease (продлевается раз в LEASE_SECONDS / 3).
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 1)
+SHARD_INDEX = int(os.getenv("SHARD_INDEX") or 0)
+LEASE_SECONDS = float(os.getenv("LEASE_SECONDS") or 30)
+if SHARD_COUNT > 1:
+    DATA_DIR = os.path.join(DATA_DIR, f"shard-{SHARD_INDEX}")
+
+# JSON-файлы (в /data)
+USERS_FILE = os.path.join(DATA_DIR, "users.json")
+SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
+CUSTOM_PHRASES_FILE = os.path.join(DATA_DIR, "custom_phrases.json")
+STATS_FILE = os.path.join(DATA_DIR, "stats.json")
+
+# Хэш последнего установленного в Telegram списка команд (см. set_bot_commands)
+COMMANDS_HASH_FILE = os.path.join(DATA_DIR, "commands_hash.json")
+
+# Кэш упоминаний пользователей (@username / имя): сколько записей держать
+# и сколько секунд доверять записи без повторного запроса к Telegram
+MENTION_CACHE_SIZE = int(os.getenv("MENTION_CACHE_SIZE") or 10000)
+MENTION_CACHE_TTL = int(os.getenv("MENTION_CACHE_TTL") or 6 * 3600)
+
+# Параллельные запросы упоминаний для /statistics: сколько одновременно
+# и сколько секунд ждать одного пользователя, прежде чем показать "User id"
+MENTION_CONCURRENCY = int(os.getenv("MENTION_CONCURRENCY") or 8)
+MENTION_TIMEOUT = float(os.getenv("MENTION_TIMEOUT") or 5)
+
+# Сколько строк статистики показывать на одной странице
+STATS_PAGE_SIZE = 20
+
+# Лимиты исходящих сообщений (ограничения Telegram): всего в секунду
+# и в одну группу в минуту; сколько сообщений отправлять параллельно
+SEND_GLOBAL_PER_SECOND = 30
+SEND_CHAT_PER_MINUTE = 20
+SEND_WORKERS = 4
+
+# Где хранить состояние: "json" — файлы выше, "sqlite" — база SQLITE_FILE.
+# При первом запуске с sqlite содержимое JSON-файлов переносится в базу.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND") or "json"
+SQLITE_FILE = os.getenv("SQLITE_FILE") or os.path.join(DATA_DIR, "victim_bot.sqlite3")
+
+# Как часто (в секундах) сбрасывать изменённое состояние из памяти на диск
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL") or 5)
+
+# Журнал изменений: вместо перезаписи файлов целиком дописываем мелкие
+# записи в *.journal и пересобираем снимок, когда журнал вырастет
+JOURNAL_ENABLED = (os.getenv("JOURNAL_ENABLED") or "0") == "1"
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES") or 1024 * 1024)
+
+# Режим получения апдейтов: "polling" или "webhook". Для webhook бот
+# поднимает HTTP-сервер на WEBHOOK_HOST:WEBHOOK_PORT и, если задан
+# WEBHOOK_URL (внешний адрес без пути), регистрирует WEBHOOK_URL + WEBHOOK_PATH
+RUN_MODE = os.getenv("RUN_MODE") or "polling"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or ""
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or "/webhook"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or ""
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST") or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or 8080)
+
+# Как часто (в секундах) писать в лог задержки обработки апдейтов
+LATENCY_REPORT_SECONDS = 600
+
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics
+# (0 — не запускать). /botstats доступна пользователям из ADMIN_IDS.
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+ADMIN_IDS = {int(x) for x in (os.getenv("ADMIN_IDS") or "").replace(" ", "").split(",") if x}
+
+# Временная зона
+TIMEZONE = "Europe/Moscow"
+
+# Лимиты (только из config.py!)
+DAILY_LIMIT_PER_CHAT = 1
+MIN_MEMBERS_TO_PICK = 2
+
+# В жеребьёвке участвуют только те, кто проявлялся за последние N дней
+# (0 — учитывать всех, кто когда-либо писал в чат)
+ACTIVE_WINDOW_DAYS = int(os.getenv("ACTIVE_WINDOW_DAYS") or 30)
+
+# Автозапуск: через сколько часов после дня последней жеребьёвки чат
+# разыгрывает жертву сам, и через сколько секунд перепроверить чат,
+# в котором пока не набралось участников
+AUTORUN_IDLE_HOURS = 72
+AUTORUN_RETRY_SECONDS = 3600
+
+# Автозапуск во многих чатах сразу (например, после простоя бота): сколько
+# чатов разыгрывать одновременно, сколько брать за такт (остальные — в
+# следующих тактах, раз в AUTORUN_TICK_SECONDS) и на сколько секунд
+# разнести просроченные чаты, чтобы они не сработали в одну секунду
+AUTORUN_WORKERS = 8
+AUTORUN_PER_TICK = 20
+AUTORUN_TICK_SECONDS = 1.0
+AUTORUN_JITTER_SECONDS = 600
+
+# Команды меню
+COMMANDS = [
+    {"command": "victim", "description": "Выбрать жертву дня"},
+    {"command": "statistics", "description": "Статистика жертв"},
+    {"command": "add_phrase", "description": "Добавить свою фразу"},
+    {"command": "del_phrase", "description": "Удалить свою фразу"},
+    {"command": "list_phrases", "description": "Показать все фразы"},
+    {"command": "help", "description": "Помощь"},
+]
+
+WELCOME_GROUP_MESSAGE = (
+    "Бот жеребьёвки активирован!\n\n"
+    "Достаточно чтобы каждый участник написал хотя бы одно сообщение или поставил реакцию, "
+    "иначе он не попадёт в жеребьёвку!\n\n"
+    "Лимит жеребьёвок в этом чате: {limit} в сутки.\n"
+    "Для помощи: /help"
+)
+HELP_MESSAGE = (
+    "<b>Команды бота:</b>\n"
+    "/victim — выбрать жертву дня\n"
+    "/statistics — статистика попаданий (week, month, year, all или streak — за период и серии)\n"
+    "/add_phrase текст — добавить свою фразу, {mention} — место для имени жертвы\n"
+    "/del_phrase номер — удалить свою фразу\n"
+    "/list_phrases — показать все фразы\n"
+)
 AUTO_RUN_MESSAGE = "Давно никто не выбирал жертву дня, запускаю жеребьёвку!"
\ No newline at end of file
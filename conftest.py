@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+import pytest
+
+# config читает DATA_DIR при импорте: тестам нужна временная папка
+# вместо настоящих данных бота (токен при импорте victim_bot не нужен)
+os.environ.pop("BOT_TOKEN", None)
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="victim_test_")
+
+STATE_DOCUMENTS = ("users", "settings", "custom_phrases", "stats")
+
+@pytest.fixture
+def state_files(tmp_path):
+    # Пути JSON-документов состояния в папке (по умолчанию — tmp_path теста)
+    def make(directory=tmp_path):
+        return {name: str(directory / f"{name}.json") for name in STATE_DOCUMENTS}
+    return make
+
+@pytest.fixture
+def files(state_files):
+    return state_files()
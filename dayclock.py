@@ -0,0 +1,41 @@
+import time
+from datetime import datetime, timedelta
+
+
+class DayClock:
+    # «Сегодня» в часовом поясе бота. Дата вычисляется один раз и
+    # пересчитывается только после местной полуночи — до неё today() и
+    # bucket() стоят одного сравнения чисел. tz — объект pytz.
+
+    def __init__(self, tz, clock=time.time):
+        self.tz = tz
+        self.clock = clock
+        self._next_midnight = float("-inf")
+        self._date = None
+        self._text = None
+        self._bucket = None
+
+    def _roll(self):
+        now = self.clock()
+        if now < self._next_midnight:
+            return
+        day = datetime.fromtimestamp(now, self.tz).date()
+        midnight = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        self._next_midnight = self.tz.localize(midnight).timestamp()
+        self._date = day
+        self._text = day.strftime("%Y-%m-%d")
+        self._bucket = day.toordinal()
+
+    def date(self):
+        self._roll()
+        return self._date
+
+    def today(self):
+        # "YYYY-MM-DD", как в settings.last_run_date
+        self._roll()
+        return self._text
+
+    def bucket(self):
+        # Номер дня для участников (см. storage.participants.day_bucket)
+        self._roll()
+        return self._bucket
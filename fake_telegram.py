@@ -0,0 +1,105 @@
+import asyncio
+import random
+import time
+from collections import Counter
+
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, GetChatMember, SendMessage
+from aiogram.types import Chat, ChatMemberMember, Message, User
+
+# =============== ЛОКАЛЬНАЯ ЗАМЕНА BOT API ==================
+class FakeTelegram(BaseSession):
+    # Сессия aiogram, которая никуда не ходит по сети: запоминает отправленные
+    # сообщения, отвечает на get_chat_member с задержкой member_latency и
+    # с вероятностью flood_rate отвечает на запрос ошибкой 429.
+
+    def __init__(self, member_latency=0.0, flood_rate=0.0, retry_after=0, seed=0):
+        super().__init__()
+        self.member_latency = member_latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.floods = 0
+        self.sent = []
+        self._message_id = 0
+
+    def _maybe_flood(self, method):
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.floods += 1
+            raise TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=self.retry_after)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if isinstance(method, GetChatMember):
+            if self.member_latency:
+                await asyncio.sleep(self.member_latency)
+            self._maybe_flood(method)
+            user_id = method.user_id
+            return ChatMemberMember(user=User(id=user_id, is_bot=False, first_name=f"User{user_id}", username=f"user{user_id}"))
+        if isinstance(method, SendMessage):
+            self._maybe_flood(method)
+            self._message_id += 1
+            self.sent.append((method.chat_id, method.text))
+            return Message(
+                message_id=self._message_id,
+                date=int(time.time()),
+                chat=Chat(id=int(method.chat_id), type="supergroup"),
+                text=method.text,
+            )
+        if isinstance(method, EditMessageText):
+            self.sent.append((method.chat_id, method.text))
+            return True
+        return True
+
+    async def close(self):
+        pass
+
+    def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        # Бот файлы не скачивает, и заглушка этого не имитирует: ошибка
+        # сразу при вызове, а не пустой файл
+        raise RuntimeError(f"FakeTelegram не имитирует скачивание файлов: {url}")
+
+# =============== СИНТЕТИЧЕСКИЕ АПДЕЙТЫ ==================
+class UpdateFactory:
+    def __init__(self):
+        self._update_id = 0
+        self._message_id = 0
+
+    def message(self, chat_id, user_id, text):
+        self._update_id += 1
+        self._message_id += 1
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"chat {chat_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+                "text": text,
+                "entities": (
+                    [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                    if text.startswith("/") else None
+                ),
+            },
+        }
+
+    def callback(self, chat_id, user_id, data, accessible=True):
+        # Нажатие inline-кнопки под сообщением бота; accessible=False — под
+        # сообщением, которое Telegram уже не отдаёт (date=0)
+        self._update_id += 1
+        self._message_id += 1
+        message = {"message_id": self._message_id, "date": 0, "chat": {"id": chat_id, "type": "supergroup"}}
+        if accessible:
+            message.update(date=int(time.time()), text="…", **{"from": {"id": 1, "is_bot": True, "first_name": "Bot"}})
+        return {
+            "update_id": self._update_id,
+            "callback_query": {
+                "id": str(self._update_id),
+                "chat_instance": str(chat_id),
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "message": message,
+                "data": data,
+            },
+        }
@@ -0,0 +1,105 @@
+import asyncio
+import html
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramRetryAfter
+
+# =============== ФОРМАТ УПОМИНАНИЯ ==================
+def format_mention(user):
+    if user.username:
+        return f"@{user.username}"
+    elif user.full_name:
+        return html.escape(user.full_name)
+    else:
+        return f"User {user.id}"
+
+# =============== КЭШ УПОМИНАНИЙ ==================
+class MentionCache:
+    # Готовые упоминания по ключу (chat_id, user_id) с ограниченным сроком
+    # жизни (ttl, секунды) и вытеснением давно не использованных записей,
+    # когда их больше maxsize.
+
+    def __init__(self, maxsize=10000, ttl=3600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, chat_id, user_id):
+        key = (int(chat_id), int(user_id))
+        item = self._items.get(key)
+        if item is not None:
+            mention, expires = item
+            if expires > self.clock():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return mention
+            del self._items[key]
+        self.misses += 1
+        return None
+
+    def put(self, chat_id, user_id, mention):
+        if self.maxsize <= 0:
+            return
+        key = (int(chat_id), int(user_id))
+        self._items[key] = (mention, self.clock() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(self, chat_id, user_id=None):
+        if user_id is not None:
+            self._items.pop((int(chat_id), int(user_id)), None)
+            return
+        chat_id = int(chat_id)
+        for key in [k for k in self._items if k[0] == chat_id]:
+            del self._items[key]
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+# =============== ПАКЕТНОЕ РАЗРЕШЕНИЕ ==================
+async def _lookup_with_retry(lookup, user_id, max_retries):
+    attempt = 0
+    while True:
+        try:
+            return await lookup(user_id)
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать — ждём и пробуем снова
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+async def resolve_mentions(lookup, user_ids, concurrency=8, timeout=5.0, max_retries=2):
+    # Запрашивает упоминания параллельно, не больше concurrency за раз.
+    # Любая ошибка или превышение timeout для одного id даёт "User {id}",
+    # остальные результаты это не задерживает. Порядок как в user_ids.
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve_one(user_id):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(_lookup_with_retry(lookup, user_id, max_retries), timeout)
+            except Exception as e:
+                logging.warning(f"Не удалось получить упоминание {user_id}: {e!r}")
+                return f"User {user_id}"
+
+    return await asyncio.gather(*(resolve_one(user_id) for user_id in user_ids))
@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+
+from aiohttp import web
+
+# =============== МЕТРИКИ ==================
+# Минимальный реестр в духе Prometheus: счётчики, суммы времени и
+# значения, которые вычисляются в момент запроса (collect).
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, key, value
+
+
+class Summary:
+    # Количество и сумма наблюдений (например, секунд) по меткам
+    kind = "summary"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            count, total = self.values.get(key, (0, 0.0))
+            self.values[key] = (count + 1, total + value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        return self.values.get(_label_key(labels), (0, 0.0))[0]
+
+    def totals(self):
+        count = sum(c for c, _ in self.values.values())
+        total = sum(t for _, t in self.values.values())
+        return count, total
+
+    def samples(self):
+        for key, (count, total) in sorted(self.values.items()):
+            yield f"{self.name}_count", key, count
+            yield f"{self.name}_sum", key, round(total, 6)
+
+
+class Gauge:
+    # Значение берётся из функции при каждом запросе метрик. Функция
+    # возвращает число или словарь {метка: число} для метки label.
+    kind = "gauge"
+
+    def __init__(self, name, help, func, label=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.label = label
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            for label_value, v in sorted(value.items()):
+                yield self.name, ((self.label, str(label_value)),), v
+        else:
+            yield self.name, (), value
+
+
+class _Timer:
+    def __init__(self, summary, labels):
+        self.summary = summary
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.summary.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.started = time.time()
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help):
+        return self.metrics.get(name) or self._add(Counter(name, help))
+
+    def summary(self, name, help):
+        return self.metrics.get(name) or self._add(Summary(name, help))
+
+    def gauge(self, name, help, func, label=None):
+        return self._add(Gauge(name, help, func, label))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, key, value in metric.samples():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            except Exception as e:
+                logging.error(f"Ошибка сбора метрики {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Общие метрики, которые пишут разные модули
+HANDLER_SECONDS = REGISTRY.summary("victim_handler_seconds", "Время обработчиков по командам")
+STORAGE_SECONDS = REGISTRY.summary("victim_storage_seconds", "Время операций с файлами состояния")
+# Вызовы бэкенда включают в себя файловые операции: отдельная метрика, чтобы
+# не складывать время одного уровня с временем вложенного
+STORAGE_CALL_SECONDS = REGISTRY.summary("victim_storage_call_seconds", "Время вызовов хранилища по бэкенду и методу")
+STORAGE_BYTES = REGISTRY.counter("victim_storage_bytes_total", "Прочитано и записано байт состояния")
+API_SECONDS = REGISTRY.summary("victim_api_seconds", "Время запросов к Bot API по методам")
+API_ERRORS = REGISTRY.counter("victim_api_errors_total", "Ошибки запросов к Bot API")
+DRAWS = REGISTRY.counter("victim_draws_total", "Проведённые жеребьёвки")
+
+# =============== ЗАПРОСЫ К BOT API ==================
+async def api_metrics_middleware(make_request, bot, method):
+    # Подключается через bot.session.middleware(...)
+    name = type(method).__name__
+    started = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    except Exception as e:
+        API_ERRORS.inc(method=name, error=type(e).__name__)
+        raise
+    finally:
+        API_SECONDS.observe(time.perf_counter() - started, method=name)
+
+# =============== HTTP-ЭНДПОИНТ ==================
+async def start_metrics_server(host, port, registry=REGISTRY):
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,99 @@
+import html
+import logging
+import random
+from collections import OrderedDict
+from string import Formatter
+
+DEFAULT_PHRASE = "{mention} — жертва дня!"
+
+class PhraseTemplateError(ValueError):
+    pass
+
+# =============== КОМПИЛЯЦИЯ ШАБЛОНОВ ==================
+# Шаблон разбирается один раз в кортеж кусков: строки — готовый текст,
+# None — место для упоминания. Отрисовка — просто склейка. Фраза без
+# {mention} допустима: она выводится как есть.
+def compile_phrase(text, escape=True):
+    parts = []
+    try:
+        parsed = list(Formatter().parse(text))
+    except ValueError as e:
+        raise PhraseTemplateError(f"Непарная фигурная скобка: {e}") from None
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            parts.append(html.escape(literal, quote=False) if escape else literal)
+        if field is None:
+            continue
+        if field != "mention" or spec or conversion:
+            raise PhraseTemplateError(f"Недопустимая подстановка {{{field}}}, можно только {{mention}}")
+        parts.append(None)
+    return tuple(parts)
+
+def phrase_error(text):
+    # Текст ошибки шаблона или None, если фраза годится
+    try:
+        compile_phrase(text)
+    except PhraseTemplateError as e:
+        return str(e)
+    return None
+
+def render_phrase(parts, mention):
+    return "".join(mention if part is None else part for part in parts)
+
+# =============== ПУЛЫ ФРАЗ ПО ЧАТАМ ==================
+class PhrasePoolCache:
+    # Для каждого чата держит скомпилированные пользовательские фразы и
+    # готовый текст /list_phrases. Встроенные фразы компилируются один раз
+    # на всех. Запись чата сбрасывается через invalidate() при изменении фраз.
+
+    def __init__(self, builtin, loader, maxsize=10000):
+        self.builtin = tuple(compile_phrase(p, escape=False) for p in builtin)
+        self.default = compile_phrase(DEFAULT_PHRASE, escape=False)
+        self.loader = loader
+        self.maxsize = maxsize
+        self._pools = OrderedDict()
+        self._listings = OrderedDict()
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def custom(self, chat_id):
+        key = str(chat_id)
+        pool = self._pools.get(key)
+        if pool is not None:
+            self._pools.move_to_end(key)
+            return pool
+        compiled = []
+        for text in self.loader(chat_id):
+            try:
+                compiled.append(compile_phrase(text))
+            except PhraseTemplateError as e:
+                # Фразы, сохранённые до появления проверки, в жеребьёвку не
+                # идут; /list_phrases помечает их (см. phrase_error)
+                logging.warning(f"Фраза чата {chat_id} пропущена: {text!r} ({e})")
+        pool = tuple(compiled)
+        self._remember(self._pools, key, pool)
+        return pool
+
+    def choose(self, chat_id, rng=random):
+        custom = self.custom(chat_id)
+        total = len(self.builtin) + len(custom)
+        if not total:
+            return self.default
+        idx = rng.randrange(total)
+        return self.builtin[idx] if idx < len(self.builtin) else custom[idx - len(self.builtin)]
+
+    def listing(self, chat_id, build):
+        key = str(chat_id)
+        text = self._listings.get(key)
+        if text is None:
+            text = build(self.loader(chat_id))
+            self._remember(self._listings, key, text)
+        return text
+
+    def invalidate(self, chat_id):
+        self._pools.pop(str(chat_id), None)
+        self._listings.pop(str(chat_id), None)
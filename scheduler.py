@@ -0,0 +1,132 @@
+import asyncio
+import heapq
+import logging
+import time
+import zlib
+
+def jitter_for(key, window):
+    # Детерминированный сдвиг в [0, window) секунд: один и тот же чат после
+    # каждого перезапуска попадает в одно и то же место окна
+    if window <= 0:
+        return 0.0
+    return zlib.crc32(str(key).encode()) % int(window * 1000) / 1000
+
+# =============== ПЛАНИРОВЩИК ПО СРОКАМ ==================
+class DeadlineScheduler:
+    # Хранит для каждого чата момент следующего запуска (unix-время) в
+    # min-куче и спит ровно до ближайшего. Перепланирование — O(log n):
+    # старая запись в куче не удаляется, а пропускается при извлечении.
+    #
+    # Наступившие сроки обрабатываются пулом из workers задач: медленный
+    # чат занимает одно место, остальные идут дальше. За такт берётся не
+    # больше per_tick чатов; если взяли ровно столько, следующий такт —
+    # не раньше чем через tick_interval секунд, и очередь рассасывается
+    # равномерно. Чат, на котором callback упал и не назначил себе новый
+    # срок, возвращается в план через retry_after секунд.
+
+    def __init__(self, clock=time.time, workers=1, per_tick=None, tick_interval=1.0, retry_after=3600):
+        self.clock = clock
+        self.retry_after = retry_after
+        self.workers = workers
+        self.per_tick = per_tick
+        self.tick_interval = tick_interval
+        self.ticks = 0
+        self._heap = []
+        self._due = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, chat_id, due):
+        earliest = self.next_due()
+        self._due[chat_id] = due
+        heapq.heappush(self._heap, (due, chat_id))
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._compact()
+        if earliest is None or due < earliest:
+            self._wakeup.set()
+
+    def cancel(self, chat_id):
+        self._due.pop(chat_id, None)
+
+    def due_at(self, chat_id):
+        return self._due.get(chat_id)
+
+    def _compact(self):
+        self._heap = [(due, chat_id) for chat_id, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def next_due(self):
+        while self._heap:
+            due, chat_id = self._heap[0]
+            if self._due.get(chat_id) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now, limit=None):
+        chats = []
+        while limit is None or len(chats) < limit:
+            due = self.next_due()
+            if due is None or due > now:
+                break
+            _, chat_id = heapq.heappop(self._heap)
+            del self._due[chat_id]
+            chats.append(chat_id)
+        return chats
+
+    # Ошибка в одном чате пишется в лог и не мешает остальным
+    async def _guarded(self, callback, chat_id, slots):
+        try:
+            await callback(chat_id)
+        except Exception as e:
+            logging.exception(f"Ошибка автозапуска в чате {chat_id}: {e}")
+            if self.due_at(chat_id) is None:
+                self.schedule(chat_id, self.clock() + self.retry_after)
+        finally:
+            slots.release()
+
+    async def _dispatch(self, chat_ids, callback, slots, inflight):
+        # Ждём только свободного места в пуле, не завершения чатов
+        for chat_id in chat_ids:
+            await slots.acquire()
+            task = asyncio.create_task(self._guarded(callback, chat_id, slots))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+
+    async def run_batch(self, chat_ids, callback):
+        # Прогнать готовый список чатов через пул и дождаться всех
+        slots = asyncio.Semaphore(self.workers)
+        inflight = set()
+        await self._dispatch(chat_ids, callback, slots, inflight)
+        await asyncio.gather(*inflight)
+
+    async def run(self, callback):
+        # callback(chat_id) вызывается для каждого чата, чей срок наступил;
+        # следующий срок чата назначает сам callback через schedule().
+        slots = asyncio.Semaphore(self.workers)
+        inflight = set()
+        try:
+            while True:
+                self._wakeup.clear()
+                due = self.next_due()
+                now = self.clock()
+                if due is None or due > now:
+                    timeout = None if due is None else due - now
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self.ticks += 1
+                chats = self.pop_due(now, self.per_tick)
+                await self._dispatch(chats, callback, slots, inflight)
+                if self.per_tick and len(chats) == self.per_tick:
+                    await asyncio.sleep(self.tick_interval)
+        finally:
+            # Дожидаемся отменённых чатов: после выхода из run() ни один
+            # автозапуск уже не меняет состояние
+            for task in inflight:
+                task.cancel()
+            await asyncio.gather(*inflight, return_exceptions=True)
@@ -0,0 +1,219 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+
+from aiogram.exceptions import TelegramRetryAfter
+
+# Интерактивные ответы уходят раньше объявлений автозапуска
+PRIORITY_INTERACTIVE = 0
+PRIORITY_AUTORUN = 1
+
+# =============== ОГРАНИЧИТЕЛЬ СКОРОСТИ ==================
+class TokenBucket:
+    # rate токенов в секунду, не больше capacity про запас
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        # Сколько секунд ждать до появления токена (0 — можно отправлять)
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "factory", "future", "attempts", "queued_at")
+
+    def __init__(self, chat_id, factory, future, queued_at):
+        self.chat_id = chat_id
+        self.factory = factory
+        self.future = future
+        self.attempts = 0
+        self.queued_at = queued_at
+
+# =============== ОЧЕРЕДЬ ОТПРАВКИ ==================
+class SendQueue:
+    # Все исходящие сообщения проходят через одну очередь с приоритетами.
+    # Общий лимит — global_rate сообщений в секунду, в один чат —
+    # chat_per_minute в минуту. Сообщение в "перегретый" чат откладывается,
+    # не задерживая остальные чаты. На 429 ждём retry_after и повторяем.
+
+    def __init__(self, global_rate=30, chat_per_minute=20, workers=4, max_retries=3, clock=time.monotonic, max_chats=10000):
+        self.clock = clock
+        self.max_chats = max_chats
+        self.workers = workers
+        self.max_retries = max_retries
+        self.chat_per_minute = chat_per_minute
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latencies = deque(maxlen=1000)
+        self._global = TokenBucket(global_rate, global_rate, clock)
+        self._chats = OrderedDict()
+        self._seq = itertools.count()
+        self._queue = None
+        self._tasks = []
+        self._later = {}
+        self._closed = False
+
+    def start(self):
+        if self._tasks or self._closed:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        # После close() очередь не принимает сообщений и не перезапускает
+        # обработчики: при остановке бота ничего не уходит после сброса состояния
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        for item, handle in self._later.items():
+            handle.cancel()
+            self._reject(item)
+        self._later = {}
+        while self._queue is not None and not self._queue.empty():
+            self._reject(self._queue.get_nowait()[2])
+
+    async def send(self, chat_id, factory, priority=PRIORITY_INTERACTIVE):
+        # factory() должна возвращать новый awaitable запроса к API при
+        # каждом вызове: при повторе после 429 запрос создаётся заново.
+        # Результат — ответ Telegram; ошибка отправки пробрасывается вызывающему.
+        if self._closed:
+            raise RuntimeError("Очередь отправки закрыта")
+        self.start()
+        item = _Outgoing(chat_id, factory, asyncio.get_running_loop().create_future(), self.clock())
+        self._put(priority, item)
+        return await item.future
+
+    @property
+    def depth(self):
+        return (self._queue.qsize() if self._queue else 0) + len(self._later)
+
+    def _put(self, priority, item):
+        self._queue.put_nowait((priority, next(self._seq), item))
+
+    def _reject(self, item):
+        if not item.future.done():
+            item.future.set_exception(RuntimeError("Очередь отправки закрыта"))
+
+    def _put_later(self, delay, priority, item):
+        # Отложенные сообщения помнят свой таймер, чтобы close() мог их отклонить
+        def requeue():
+            del self._later[item]
+            self._put(priority, item)
+
+        self._later[item] = asyncio.get_running_loop().call_later(delay, requeue)
+
+    def _chat_bucket(self, chat_id):
+        # Один чат — одна корзина, в каком бы виде ни пришёл id (автозапуск
+        # передаёт str из настроек, обработчики — int)
+        chat_id = int(chat_id)
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        # Давно не писавшие чаты вытесняются по одному; полная корзина ничем
+        # не отличается от новой, поэтому не полную не трогаем
+        while len(self._chats) >= self.max_chats and next(iter(self._chats.values())).full:
+            self._chats.popitem(last=False)
+        rate = self.chat_per_minute / 60
+        bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_per_minute, self.clock)
+        return bucket
+
+    async def _worker(self):
+        # Сбой на одном сообщении не должен убивать обработчик: start() не
+        # пересоздаёт упавшие задачи, и очередь встала бы навсегда
+        while True:
+            priority, _, item = await self._queue.get()
+            try:
+                await self._process(priority, item)
+            except Exception as e:
+                logging.exception(f"Ошибка отправки в чат {item.chat_id}: {e}")
+                if not item.future.done():
+                    item.future.set_exception(e)
+
+    async def _process(self, priority, item):
+        if item.future.done():
+            return
+        chat_bucket = self._chat_bucket(item.chat_id)
+        wait = chat_bucket.delay()
+        if wait > 0:
+            self._put_later(wait, priority, item)
+            return
+        wait = self._global.delay()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._global.delay()
+        self._global.take()
+        chat_bucket.take()
+        await self._deliver(priority, item)
+
+    async def _deliver(self, priority, item):
+        try:
+            result = await item.factory()
+        except TelegramRetryAfter as e:
+            if item.attempts < self.max_retries:
+                item.attempts += 1
+                self.retried += 1
+                logging.warning(f"Флуд-лимит в чате {item.chat_id}, повтор через {e.retry_after} с")
+                self._put_later(e.retry_after, priority, item)
+                return
+            self.failed += 1
+            if not item.future.done():
+                item.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            self.sent += 1
+            self.latencies.append(self.clock() - item.queued_at)
+            if not item.future.done():
+                item.future.set_result(result)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "latency_p50": pct(0.5),
+            "latency_p95": pct(0.95),
+            "latency_max": round(latencies[-1], 3) if latencies else 0.0,
+        }
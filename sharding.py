@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+
+from aiohttp import ClientSession, web
+
+from storage.filelock import FileLock
+from webhook import SECRET_HEADER
+
+# =============== РАСПРЕДЕЛЕНИЕ ЧАТОВ ==================
+def shard_of(chat_id, count):
+    # Стабильно между процессами и перезапусками (в отличие от hash())
+    if count <= 1:
+        return 0
+    return zlib.crc32(str(int(chat_id)).encode()) % count
+
+def update_chat_id(update):
+    # chat.id из сырого апдейта Telegram; для апдейтов без чата
+    # (inline-запросы и т. п.) — id пользователя
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        if "chat" in value:
+            return value["chat"]["id"]
+        if isinstance(value.get("message"), dict) and "chat" in value["message"]:
+            return value["message"]["chat"]["id"]
+        if "from" in value:
+            return value["from"]["id"]
+    return 0
+
+# =============== ВЛАДЕНИЕ ПАПКОЙ ДАННЫХ ==================
+# Каждый процесс держит состояние шарда в памяти и пишет его снимками, так
+# что два живых процесса на одной папке затирали бы изменения друг друга.
+# Поэтому папкой владеет один процесс — всё время своей жизни; второй
+# (резервный, или новый при перезапуске с перекрытием) ждёт, пока первый
+# завершится, и только потом читает состояние с диска.
+async def hold_data_dir(data_dir):
+    lock = FileLock(os.path.join(data_dir, "process.lock"))
+    if not await asyncio.to_thread(lock.acquire, False):
+        logging.warning(f"{data_dir} занята другим процессом, ждём её освобождения")
+        await asyncio.to_thread(lock.acquire)
+    return lock
+
+# =============== АРЕНДА ПЛАНИРОВЩИКА ==================
+class ShardLease:
+    # Аренда роли владельца планировщика шарда: файл {"owner", "expires"}.
+    # Владелец продлевает аренду каждые ttl / 3 секунд; если он завис или
+    # умер, после expires её забирает другой процесс того же шарда.
+    # Обычно аренду получает владелец папки (hold_data_dir); она остаётся
+    # страховкой, если flock не работает (например, папка на сетевом диске).
+
+    def __init__(self, path, owner, ttl=30.0, clock=time.time):
+        self.path = path
+        self.owner = owner
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = FileLock(f"{path}.lock")
+        self.held = False
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def try_acquire(self):
+        # Захват и продление — одна и та же операция
+        with self._lock:
+            now = self.clock()
+            current = self._read()
+            if current.get("owner") not in (None, self.owner) and current.get("expires", 0) > now:
+                self.held = False
+                return False
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"owner": self.owner, "expires": now + self.ttl}, f)
+            os.replace(tmp, self.path)
+            self.held = True
+            return True
+
+    def release(self):
+        with self._lock:
+            if self._read().get("owner") == self.owner:
+                os.remove(self.path)
+        self.held = False
+
+    async def hold(self, factory):
+        # Запускает factory() на время владения арендой; потеряли аренду —
+        # задача отменяется, и процесс снова ждёт своей очереди. Упавшая
+        # задача перезапускается при следующем продлении: держать аренду
+        # без работающего планировщика нельзя
+        task = None
+        try:
+            while True:
+                acquired = await asyncio.to_thread(self.try_acquire)
+                if task is not None and task.done():
+                    error = None if task.cancelled() else task.exception()
+                    logging.error(f"{self.owner}: задача аренды {self.path} завершилась, перезапуск", exc_info=error)
+                    task = None
+                if acquired and task is None:
+                    logging.info(f"{self.owner}: получена аренда {self.path}")
+                    task = asyncio.create_task(factory())
+                elif not acquired and task is not None:
+                    logging.warning(f"{self.owner}: аренда {self.path} потеряна")
+                    task.cancel()
+                    task = None
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            if self.held:
+                await asyncio.to_thread(self.release)
+
+# =============== ЛОКАЛЬНЫЙ МАРШРУТИЗАТОР ==================
+# Telegram шлёт все апдейты на один адрес; маршрутизатор принимает их
+# и пересылает в процесс шарда по chat_id:
+#   python sharding.py --port 8080 --path /webhook \
+#       http://127.0.0.1:8081 http://127.0.0.1:8082
+HTTP_SESSION = web.AppKey("http_session", ClientSession)
+
+def build_router(targets, path, secret_token=None):
+    async def forward(request):
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        target = targets[shard_of(update_chat_id(update), len(targets))]
+        headers = {"Content-Type": "application/json"}
+        if secret_token:
+            headers[SECRET_HEADER] = secret_token
+        async with request.app[HTTP_SESSION].post(target.rstrip("/") + path, data=body, headers=headers) as resp:
+            return web.Response(status=resp.status)
+
+    async def session_ctx(app):
+        app[HTTP_SESSION] = ClientSession()
+        yield
+        await app[HTTP_SESSION].close()
+
+    app = web.Application()
+    app.router.add_post(path, forward)
+    app.cleanup_ctx.append(session_ctx)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Маршрутизатор webhook-апдейтов по шардам")
+    parser.add_argument("targets", nargs="+", help="адреса процессов шардов по порядку SHARD_INDEX")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET") or None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    web.run_app(build_router(args.targets, args.path, args.secret), host=args.host, port=args.port)
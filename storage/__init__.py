@@ -0,0 +1,42 @@
+import os
+
+from storage.base import StorageBackend
+from storage.filelock import FileLock
+from storage.instrumented import InstrumentedBackend
+from storage.json_backend import JsonBackend
+from storage.sqlite_backend import SqliteBackend
+from storage.state import StateStore, load_json, save_json
+
+
+def json_files(cfg):
+    return {
+        "users": cfg.USERS_FILE,
+        "settings": cfg.SETTINGS_FILE,
+        "custom_phrases": cfg.CUSTOM_PHRASES_FILE,
+        "stats": cfg.STATS_FILE,
+    }
+
+def create_backend(cfg, today=None):
+    # Бэкенд выбирается в config.STORAGE_BACKEND: "json" (по умолчанию) или "sqlite"
+    # Вызовы оборачиваются замером времени (метрика victim_storage_call_seconds).
+    # today() — номер текущего дня в часовом поясе бота (DayClock.bucket)
+    if cfg.STORAGE_BACKEND == "sqlite":
+        backend = SqliteBackend(cfg.SQLITE_FILE, json_files=json_files(cfg), today=today)
+    elif cfg.STORAGE_BACKEND == "json":
+        backend = JsonBackend(
+            json_files(cfg),
+            today=today,
+            flush_interval=cfg.FLUSH_INTERVAL,
+            journal=cfg.JOURNAL_ENABLED,
+            compact_bytes=cfg.JOURNAL_COMPACT_BYTES,
+            lock=FileLock(os.path.join(cfg.DATA_DIR, "state.lock")),
+        )
+    else:
+        raise ValueError(f"Неизвестный STORAGE_BACKEND: {cfg.STORAGE_BACKEND}")
+    return InstrumentedBackend(backend)
+
+
+__all__ = [
+    "StorageBackend", "FileLock", "InstrumentedBackend", "JsonBackend", "SqliteBackend", "StateStore",
+    "create_backend", "json_files", "load_json", "save_json",
+]
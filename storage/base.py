@@ -0,0 +1,130 @@
+from contextlib import nullcontext
+
+from storage.participants import day_bucket
+
+
+# =============== ИНТЕРФЕЙС ХРАНИЛИЩА ==================
+# Все обращения бота к сохранённому состоянию идут через эти методы.
+# chat_id и user_id принимаются в любом виде (int или str);
+# статистика возвращается как {str(user_id): число попаданий}.
+class StorageBackend:
+    name = "base"
+    # Номер сегодняшнего дня для участников. Бот передаёт в конструктор
+    # день в своём часовом поясе (DayClock.bucket); по умолчанию — дата хоста
+    today = staticmethod(day_bucket)
+
+    def load(self):
+        pass
+
+    def start(self):
+        pass
+
+    async def close(self, flush=True):
+        # flush=False — не записывать несохранённое (выгрузка и копия
+        # только читают и не должны трогать файлы работающего бота)
+        pass
+
+    # --- участники ---
+    def get_participants(self, chat_id):
+        # {int(user_id): день последней активности, см. storage.participants}
+        raise NotImplementedError
+
+    def get_users(self, chat_id):
+        return list(self.get_participants(chat_id))
+
+    def set_users(self, chat_id, users, bucket=None):
+        raise NotImplementedError
+
+    def touch_user(self, chat_id, user_id, bucket):
+        # Отмечает активность. Пишет в хранилище, только если участник новый
+        # или сменился день. Возвращает True для нового участника.
+        raise NotImplementedError
+
+    def add_user(self, chat_id, user_id):
+        return self.touch_user(chat_id, user_id, self.today())
+
+    # --- настройки ---
+    def get_settings(self, chat_id):
+        raise NotImplementedError
+
+    def set_setting(self, chat_id, key, value):
+        raise NotImplementedError
+
+    def iter_settings(self):
+        # Пары (str(chat_id), dict настроек) по всем чатам
+        raise NotImplementedError
+
+    # --- пользовательские фразы ---
+    def get_custom_phrases(self, chat_id):
+        raise NotImplementedError
+
+    def add_custom_phrase(self, chat_id, phrase):
+        raise NotImplementedError
+
+    def del_custom_phrase(self, chat_id, idx):
+        # Возвращает удалённую фразу или None, если номера нет
+        raise NotImplementedError
+
+    # --- история жеребьёвок и статистика ---
+    # Каждая жеребьёвка дописывается в историю и сразу добавляется в
+    # корзины: за день ("d", ключ "YYYY-MM-DD"), за месяц ("m", "YYYY-MM")
+    # и в итог за всё время. Статистика за период читается из корзин.
+    def record_draw(self, chat_id, user_id, kind, ts, day):
+        # kind — "manual" или "autorun", ts — unix-время, day — "YYYY-MM-DD"
+        raise NotImplementedError
+
+    def get_stats_for_chat(self, chat_id):
+        # Итог за всё время: {str(user_id): попаданий}
+        raise NotImplementedError
+
+    def get_buckets(self, chat_id, period, first, last):
+        # {ключ корзины: {str(user_id): попаданий}} для first <= ключ <= last
+        raise NotImplementedError
+
+    def get_draws(self, chat_id):
+        # История жеребьёвок чата: [{"user_id", "ts", "kind"}, ...]
+        raise NotImplementedError
+
+    # --- выгрузка и восстановление (python -m victim_bot export|import|backup) ---
+    def read_snapshot(self):
+        # Контекст, внутри которого все чтения видят одно состояние на момент
+        # входа; работающий бот при этом не останавливается
+        return nullcontext()
+
+    def iter_chats(self):
+        # id всех чатов, о которых что-то хранится, по возрастанию
+        raise NotImplementedError
+
+    def export_chat(self, chat_id):
+        # Состояние одного чата одной записью (строка NDJSON); история
+        # жеребьёвок выгружается отдельно (iter_draws)
+        chat_id = int(chat_id)
+        return {
+            "chat_id": chat_id,
+            "users": {str(user_id): seen for user_id, seen in self.get_participants(chat_id).items()},
+            "settings": self.get_settings(chat_id),
+            "custom_phrases": self.get_custom_phrases(chat_id),
+            "stats": self.get_stats_for_chat(chat_id),
+            "draw_buckets": {period: self.get_buckets(chat_id, period, "0000", "9999") for period in ("d", "m")},
+        }
+
+    def iter_draws(self, chat_ids=None):
+        # История жеребьёвок по одной записи {"chat_id", "user_id", "ts", "kind"},
+        # не держа её в памяти; chat_ids — только эти чаты
+        for chat_id in (chat_ids if chat_ids else self.iter_chats()):
+            for draw in self.get_draws(chat_id):
+                yield {"chat_id": int(chat_id), **draw}
+
+    def restore_chat(self, record):
+        # Заменяет состояние чата record["chat_id"] записью из export_chat.
+        # Повторное восстановление той же записи ничего не меняет.
+        raise NotImplementedError
+
+    def replace_draws(self, chat_ids, draws):
+        # Заменяет историю жеребьёвок чатов chat_ids записями draws
+        # (итератор записей iter_draws): старая история этих чатов удаляется
+        raise NotImplementedError
+
+    def backup(self, dest):
+        # Согласованная копия хранилища в dest, не останавливая бота
+        raise NotImplementedError
@@ -0,0 +1,24 @@
+from datetime import date, timedelta
+
+# =============== СВЁРТКА КОРЗИН СТАТИСТИКИ ==================
+def merge_buckets(buckets):
+    # Сумма нескольких корзин {str(user_id): попаданий}
+    total = {}
+    for hits_by_user in buckets:
+        for user_id, hits in hits_by_user.items():
+            total[user_id] = total.get(user_id, 0) + hits
+    return total
+
+def longest_streaks(day_buckets):
+    # Самая длинная серия дней подряд, когда пользователь был жертвой:
+    # {str(user_id): дней}. Проход по дневным корзинам по порядку дат.
+    best = {}
+    current = {}
+    for key in sorted(day_buckets):
+        day = date.fromisoformat(key)
+        for user_id in day_buckets[key]:
+            last_day, length = current.get(user_id, (None, 0))
+            length = length + 1 if last_day == day - timedelta(days=1) else 1
+            current[user_id] = (day, length)
+            best[user_id] = max(best.get(user_id, 0), length)
+    return best
@@ -0,0 +1,48 @@
+import fcntl
+import os
+import threading
+
+
+class FileLock:
+    # Эксклюзивная блокировка fcntl.flock на файле — общая для процессов
+    # одного хоста. Снимается ядром, если процесс умер, поэтому «зависших»
+    # блокировок не бывает. Потоки одного процесса сначала встают в очередь
+    # на обычный threading.Lock; повторный вход не поддерживается.
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BaseException as e:
+            os.close(fd)
+            self._thread_lock.release()
+            if isinstance(e, BlockingIOError):
+                return False
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
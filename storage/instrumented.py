@@ -0,0 +1,36 @@
+import time
+
+from metrics import STORAGE_CALL_SECONDS
+from storage.base import StorageBackend
+
+# Методы интерфейса, время которых считаем (по имени бэкенда и метода)
+TIMED_METHODS = [
+    name for name, value in vars(StorageBackend).items()
+    if callable(value) and not name.startswith("_") and name not in ("load", "start", "close")
+]
+
+
+class InstrumentedBackend:
+    # Обёртка над любым бэкендом: тот же интерфейс плюс замер времени вызовов
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.name = inner.name
+        for method in TIMED_METHODS:
+            setattr(self, method, self._timed(method, getattr(inner, method)))
+
+    def _timed(self, method, func):
+        op = f"{self.name}.{method}"
+
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, op=op)
+
+        wrapper.__name__ = method
+        return wrapper
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
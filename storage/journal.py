@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import time
+
+from metrics import STORAGE_BYTES, STORAGE_SECONDS
+
+# Ключ, под которым в снимке хранится номер последней учтённой записи журнала
+JOURNAL_SEQ_KEY = "_journal_seq"
+
+# =============== ОПЕРАЦИИ НАД ДОКУМЕНТОМ ==================
+# Каждое изменение описывается маленькой записью [op, path, value],
+# где path — список ключей от корня документа. Одна и та же функция
+# применяет изменение и в рабочем режиме, и при восстановлении из журнала.
+def apply_op(doc, op, path, value=None):
+    *parents, key = path
+    node = doc
+    for part in parents:
+        node = node.setdefault(part, {})
+    if op == "set":
+        node[key] = value
+    elif op == "incr":
+        node[key] = node.get(key, 0) + value
+        return node[key]
+    elif op == "append":
+        node.setdefault(key, []).append(value)
+    elif op == "pop":
+        arr = node.get(key, [])
+        if 0 <= value < len(arr):
+            return arr.pop(value)
+    elif op == "del":
+        return node.pop(key, None)
+    else:
+        raise ValueError(f"Неизвестная операция журнала: {op}")
+    return None
+
+def fsync_dir(path):
+    # Без fsync каталога переименование файла может не пережить сбой питания
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# =============== ЖУРНАЛ ==================
+class Journal:
+    # Файл из JSON-строк вида [seq, op, path, value], только дописывается.
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def read(self):
+        return list(self.iter())
+
+    def iter(self, limit=None):
+        # Записи по одной, не читая файл целиком; limit — сколько байт от
+        # начала файла читать (записи, дописанные позже, не попадут)
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, "rb") as f:
+            for lineno, line in enumerate(f, 1):
+                offset += len(line)
+                if limit is not None and offset > limit:
+                    return
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка — след сбоя посреди записи
+                    logging.warning(f"Пропущена повреждённая запись {self.path}:{lineno}")
+
+    def disk_size(self):
+        # Размер на диске прямо сейчас (size учитывает только свои записи)
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def replace(self, lines):
+        # Переписывает файл строками lines (итератор) атомарно, как снимок
+        started = time.perf_counter()
+        tmp = f"{self.path}.tmp"
+        size = 0
+        with open(tmp, "wb") as f:
+            for line in lines:
+                data = (line + "\n").encode("utf-8")
+                f.write(data)
+                size += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        fsync_dir(self.path)
+        self.size = size
+        STORAGE_SECONDS.observe(time.perf_counter() - started, op="journal_replace")
+        STORAGE_BYTES.inc(size, op="journal_replace")
+
+    def append(self, lines):
+        started = time.perf_counter()
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += len(data)
+        STORAGE_SECONDS.observe(time.perf_counter() - started, op="journal_append")
+        STORAGE_BYTES.inc(len(data), op="journal_append")
+
+    def truncate(self):
+        with open(self.path, "wb") as f:
+            os.fsync(f.fileno())
+        self.size = 0
@@ -0,0 +1,137 @@
+import os
+from contextlib import contextmanager
+
+from storage.base import StorageBackend
+from storage.state import StateStore
+
+
+class JsonBackend(StorageBackend):
+    # JSON-документы в памяти (см. StateStore). Корзины статистики по дням и
+    # месяцам — документ draw_buckets, история жеребьёвок — draws.jsonl;
+    # по умолчанию оба лежат рядом с файлом статистики.
+    name = "json"
+
+    def __init__(self, files, draws_log=None, today=None, **store_options):
+        if today is not None:
+            self.today = today
+        files = dict(files)
+        data_dir = os.path.dirname(files["stats"])
+        files.setdefault("draw_buckets", os.path.join(data_dir, "draw_buckets.json"))
+        draws_log = draws_log or os.path.join(data_dir, "draws.jsonl")
+        self.store = StateStore(files, logs={"draws": draws_log}, **store_options)
+        self._log_bounds = None
+
+    def load(self):
+        self.store.load()
+
+    def start(self):
+        self.store.start()
+
+    async def close(self, flush=True):
+        await self.store.close(flush)
+
+    # Участники чата хранятся как {str(user_id): день}; старый формат
+    # (список id) при чтении переводится в памяти — днём активности
+    # считается текущий, — а на диск попадает при первом изменении чата.
+    def _participants(self, chat_id):
+        members = self.store.doc("users").get(str(chat_id))
+        if isinstance(members, list):
+            bucket = self.today()
+            return {str(u): bucket for u in members}
+        return members or {}
+
+    def get_participants(self, chat_id):
+        return {int(user_id): seen for user_id, seen in self._participants(chat_id).items()}
+
+    def set_users(self, chat_id, users, bucket=None):
+        bucket = bucket or self.today()
+        self.store.apply("users", "set", [chat_id], {str(u): bucket for u in users})
+
+    def touch_user(self, chat_id, user_id, bucket):
+        members = self._participants(chat_id)
+        seen = members.get(str(user_id))
+        if seen is not None and seen >= bucket:
+            return False
+        if isinstance(self.store.doc("users").get(str(chat_id)), list):
+            self.store.apply("users", "set", [chat_id], {**members, str(user_id): bucket})
+        else:
+            self.store.apply("users", "set", [chat_id, user_id], bucket)
+        return seen is None
+
+    def get_settings(self, chat_id):
+        return dict(self.store.doc("settings").get(str(chat_id), {}))
+
+    def set_setting(self, chat_id, key, value):
+        self.store.apply("settings", "set", [chat_id, key], value)
+
+    def iter_settings(self):
+        return [(chat_id, dict(s)) for chat_id, s in self.store.doc("settings").items()]
+
+    def get_custom_phrases(self, chat_id):
+        return list(self.store.doc("custom_phrases").get(str(chat_id), []))
+
+    def add_custom_phrase(self, chat_id, phrase):
+        self.store.apply("custom_phrases", "append", [chat_id], phrase)
+
+    def del_custom_phrase(self, chat_id, idx):
+        return self.store.apply("custom_phrases", "pop", [chat_id], idx)
+
+    def record_draw(self, chat_id, user_id, kind, ts, day):
+        self.store.append_log("draws", {"chat_id": int(chat_id), "user_id": int(user_id), "ts": ts, "kind": kind})
+        self.store.apply("draw_buckets", "incr", [chat_id, "d", day, user_id], 1)
+        self.store.apply("draw_buckets", "incr", [chat_id, "m", day[:7], user_id], 1)
+        self.store.apply("stats", "incr", [chat_id, user_id], 1)
+
+    def get_stats_for_chat(self, chat_id):
+        return dict(self.store.doc("stats").get(str(chat_id), {}))
+
+    def get_buckets(self, chat_id, period, first, last):
+        buckets = self.store.doc("draw_buckets").get(str(chat_id), {}).get(period, {})
+        return {key: dict(hits) for key, hits in buckets.items() if first <= key <= last}
+
+    def get_draws(self, chat_id):
+        chat_id = int(chat_id)
+        return [
+            {"user_id": r["user_id"], "ts": r["ts"], "kind": r["kind"]}
+            for r in self.store.iter_log("draws") if r["chat_id"] == chat_id
+        ]
+
+    def _draws_log(self):
+        return self.store.iter_log("draws", self._log_bounds["draws"] if self._log_bounds else None)
+
+    # Документы и так целиком в памяти; срез — это их чтение под
+    # state.lock плюс длина лога истории на тот же момент
+    @contextmanager
+    def read_snapshot(self):
+        self._log_bounds = self.store.load_snapshot()
+        try:
+            yield
+        finally:
+            self._log_bounds = None
+
+    def iter_draws(self, chat_ids=None):
+        # Один проход по логу, по записи за раз
+        wanted = {int(chat_id) for chat_id in chat_ids or ()}
+        for r in self._draws_log():
+            if not wanted or r["chat_id"] in wanted:
+                yield {"chat_id": r["chat_id"], "user_id": r["user_id"], "ts": r["ts"], "kind": r["kind"]}
+
+    def iter_chats(self):
+        chats = set()
+        for name in self.store.files:
+            chats.update(self.store.doc(name))
+        return sorted(int(chat_id) for chat_id in chats)
+
+    def restore_chat(self, record):
+        chat_id = record["chat_id"]
+        for name, default in (("users", {}), ("settings", {}), ("custom_phrases", []), ("stats", {}), ("draw_buckets", {})):
+            self.store.apply(name, "set", [chat_id], record.get(name, default))
+
+    def replace_draws(self, chat_ids, draws):
+        # Лог переписывается целиком за один проход: без записей этих чатов
+        # и с новыми в конце
+        chats = {int(chat_id) for chat_id in chat_ids}
+        self.store.replace_log("draws", lambda r: r["chat_id"] in chats, draws)
+
+    def backup(self, dest):
+        return self.store.copy_files(dest)
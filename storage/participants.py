@@ -0,0 +1,44 @@
+from datetime import date
+
+# Время последней активности храним грубо — номером дня (date.toordinal()).
+# Пока пользователь пишет в пределах одного дня, сохранять нечего.
+def day_bucket(day=None):
+    return (day or date.today()).toordinal()
+
+def active_since(participants, since):
+    # participants: {user_id: день последней активности}
+    return [user_id for user_id, seen in participants.items() if seen >= since]
+
+
+class ParticipantIndex:
+    # Участники чатов в памяти: {chat_id: {user_id: день}}. Чат подгружается
+    # из хранилища при первом обращении, дальше проверка — поиск в словаре.
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._chats = {}
+
+    def chat(self, chat_id):
+        chat_id = int(chat_id)
+        members = self._chats.get(chat_id)
+        if members is None:
+            members = self._chats[chat_id] = dict(self._loader(chat_id))
+        return members
+
+    def touch(self, chat_id, user_id, bucket):
+        # Возвращает (новый ли участник, нужно ли сохранять)
+        members = self.chat(chat_id)
+        seen = members.get(user_id)
+        if seen is not None and seen >= bucket:
+            return False, False
+        members[user_id] = bucket
+        return seen is None, True
+
+    def replace(self, chat_id, participants):
+        self._chats[int(chat_id)] = dict(participants)
+
+    def forget(self, chat_id=None):
+        if chat_id is None:
+            self._chats.clear()
+        else:
+            self._chats.pop(int(chat_id), None)
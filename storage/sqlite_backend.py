@@ -0,0 +1,376 @@
+import json
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from storage.base import StorageBackend
+from storage.participants import ParticipantIndex
+from storage.json_backend import JsonBackend
+
+SCHEMA_VERSION = 3
+
+# Первичные ключи начинаются с chat_id, поэтому любой запрос по одному чату —
+# это диапазонный поиск по индексу, а не обход всех чатов.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS settings (
+    chat_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (chat_id, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS custom_phrases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    phrase TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS custom_phrases_chat ON custom_phrases (chat_id, id);
+
+CREATE TABLE IF NOT EXISTS stats (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# История жеребьёвок (схема 3). draw_buckets — предрассчитанные суммы по
+# дням (period = 'd') и месяцам ('m'), обновляются вместе с вставкой в draws.
+DRAWS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS draws (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS draws_chat_ts ON draws (chat_id, ts);
+
+CREATE TABLE IF NOT EXISTS draw_buckets (
+    chat_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, period, bucket, user_id)
+) WITHOUT ROWID;
+"""
+
+# Тексты запросов постоянные — sqlite3 кэширует подготовленные выражения
+# по тексту, так что каждый запрос компилируется один раз на соединение.
+SQL_GET_USERS = "SELECT user_id, last_seen FROM users WHERE chat_id = ?"
+SQL_TOUCH_USER = (
+    "INSERT INTO users (chat_id, user_id, last_seen) VALUES (?, ?, ?) "
+    "ON CONFLICT (chat_id, user_id) DO UPDATE SET last_seen = max(last_seen, excluded.last_seen)"
+)
+SQL_DEL_USERS = "DELETE FROM users WHERE chat_id = ?"
+SQL_GET_SETTINGS = "SELECT key, value FROM settings WHERE chat_id = ?"
+SQL_SET_SETTING = (
+    "INSERT INTO settings (chat_id, key, value) VALUES (?, ?, ?) "
+    "ON CONFLICT (chat_id, key) DO UPDATE SET value = excluded.value"
+)
+SQL_ALL_SETTINGS = "SELECT chat_id, key, value FROM settings ORDER BY chat_id"
+SQL_GET_PHRASES = "SELECT id, phrase FROM custom_phrases WHERE chat_id = ? ORDER BY id"
+SQL_ADD_PHRASE = "INSERT INTO custom_phrases (chat_id, phrase) VALUES (?, ?)"
+SQL_DEL_PHRASE = "DELETE FROM custom_phrases WHERE id = ?"
+SQL_INCREMENT_STAT = (
+    "INSERT INTO stats (chat_id, user_id, hits) VALUES (?, ?, ?) "
+    "ON CONFLICT (chat_id, user_id) DO UPDATE SET hits = hits + excluded.hits"
+)
+SQL_GET_STATS = "SELECT user_id, hits FROM stats WHERE chat_id = ?"
+SQL_ADD_DRAW = "INSERT INTO draws (chat_id, user_id, ts, kind) VALUES (?, ?, ?, ?)"
+SQL_INCREMENT_BUCKET = (
+    "INSERT INTO draw_buckets (chat_id, period, bucket, user_id, hits) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (chat_id, period, bucket, user_id) DO UPDATE SET hits = hits + excluded.hits"
+)
+SQL_GET_BUCKETS = (
+    "SELECT bucket, user_id, hits FROM draw_buckets "
+    "WHERE chat_id = ? AND period = ? AND bucket BETWEEN ? AND ?"
+)
+SQL_GET_DRAWS = "SELECT user_id, ts, kind FROM draws WHERE chat_id = ? ORDER BY ts, id"
+SQL_ALL_CHATS = (
+    "SELECT chat_id FROM users UNION SELECT chat_id FROM settings "
+    "UNION SELECT chat_id FROM custom_phrases UNION SELECT chat_id FROM stats "
+    "UNION SELECT chat_id FROM draw_buckets UNION SELECT chat_id FROM draws ORDER BY 1"
+)
+SQL_ALL_DRAWS = "SELECT chat_id, user_id, ts, kind FROM draws ORDER BY chat_id, ts, id"
+STATE_TABLES = ("users", "settings", "custom_phrases", "stats", "draw_buckets")
+
+
+class SqliteBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path, json_files=None, today=None):
+        if today is not None:
+            self.today = today
+        self.path = path
+        self.json_files = json_files or {}
+        self.conn = None
+        self.participants = ParticipantIndex(self._load_participants)
+
+    # =============== ПОДКЛЮЧЕНИЕ ==================
+    def load(self):
+        if self.conn is not None:
+            return
+        # load() вызывается из потока (asyncio.to_thread), дальше соединением
+        # пользуется поток event loop — по очереди, не одновременно
+        self.conn = sqlite3.connect(self.path, cached_statements=256, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self._migrate_schema()
+        self._import_json_once()
+
+    def _db(self):
+        if self.conn is None:
+            self.load()
+        return self.conn
+
+    def _migrate_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            self.conn.executescript(SCHEMA)
+        elif version < 2:
+            # Старые записи считаем активными на день обновления схемы
+            with self.conn:
+                self.conn.execute("ALTER TABLE users ADD COLUMN last_seen INTEGER NOT NULL DEFAULT 0")
+                self.conn.execute("UPDATE users SET last_seen = ?", (self.today(),))
+        if version < 3:
+            self.conn.executescript(DRAWS_SCHEMA)
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    async def close(self, flush=True):
+        # Изменения пишутся в базу сразу, сбрасывать нечего
+        self.participants.forget()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # =============== ПЕРЕНОС ИЗ JSON ==================
+    def _import_json_once(self):
+        done = self.conn.execute("SELECT value FROM meta WHERE key = 'json_imported'").fetchone()
+        if done or not any(os.path.exists(path) for path in self.json_files.values()):
+            return
+        # Читаем через JsonBackend, чтобы подхватить и недописанные журналы
+        source = JsonBackend(self.json_files).store
+        counts = import_json_documents(self.conn, source, self.today())
+        with self.conn:
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', '1')")
+        logging.info(f"Состояние перенесено из JSON в {self.path}: {counts}")
+
+    # =============== УЧАСТНИКИ ==================
+    def _load_participants(self, chat_id):
+        return dict(self._db().execute(SQL_GET_USERS, (int(chat_id),)))
+
+    def get_participants(self, chat_id):
+        return dict(self.participants.chat(chat_id))
+
+    def set_users(self, chat_id, users, bucket=None):
+        bucket = bucket or self.today()
+        db = self._db()
+        with db:
+            db.execute(SQL_DEL_USERS, (int(chat_id),))
+            db.executemany(SQL_TOUCH_USER, [(int(chat_id), int(u), bucket) for u in users])
+        self.participants.replace(chat_id, {int(u): bucket for u in users})
+
+    def touch_user(self, chat_id, user_id, bucket):
+        is_new, changed = self.participants.touch(chat_id, int(user_id), bucket)
+        if changed:
+            db = self._db()
+            with db:
+                db.execute(SQL_TOUCH_USER, (int(chat_id), int(user_id), bucket))
+        return is_new
+
+    # =============== НАСТРОЙКИ ==================
+    def get_settings(self, chat_id):
+        rows = self._db().execute(SQL_GET_SETTINGS, (int(chat_id),))
+        return {key: json.loads(value) for key, value in rows}
+
+    def set_setting(self, chat_id, key, value):
+        db = self._db()
+        with db:
+            db.execute(SQL_SET_SETTING, (int(chat_id), key, json.dumps(value, ensure_ascii=False)))
+
+    def iter_settings(self):
+        result = {}
+        for chat_id, key, value in self._db().execute(SQL_ALL_SETTINGS):
+            result.setdefault(str(chat_id), {})[key] = json.loads(value)
+        return list(result.items())
+
+    # =============== ФРАЗЫ ==================
+    def get_custom_phrases(self, chat_id):
+        return [row[1] for row in self._db().execute(SQL_GET_PHRASES, (int(chat_id),))]
+
+    def add_custom_phrase(self, chat_id, phrase):
+        db = self._db()
+        with db:
+            db.execute(SQL_ADD_PHRASE, (int(chat_id), phrase))
+
+    def del_custom_phrase(self, chat_id, idx):
+        if idx < 0:
+            return None
+        rows = self._db().execute(SQL_GET_PHRASES, (int(chat_id),)).fetchall()
+        if idx >= len(rows):
+            return None
+        phrase_id, phrase = rows[idx]
+        db = self._db()
+        with db:
+            db.execute(SQL_DEL_PHRASE, (phrase_id,))
+        return phrase
+
+    # =============== СТАТИСТИКА ==================
+    def record_draw(self, chat_id, user_id, kind, ts, day):
+        chat_id, user_id = int(chat_id), int(user_id)
+        db = self._db()
+        with db:
+            db.execute(SQL_ADD_DRAW, (chat_id, user_id, ts, kind))
+            db.execute(SQL_INCREMENT_BUCKET, (chat_id, "d", day, user_id, 1))
+            db.execute(SQL_INCREMENT_BUCKET, (chat_id, "m", day[:7], user_id, 1))
+            db.execute(SQL_INCREMENT_STAT, (chat_id, user_id, 1))
+
+    def get_stats_for_chat(self, chat_id):
+        rows = self._db().execute(SQL_GET_STATS, (int(chat_id),))
+        return {str(user_id): hits for user_id, hits in rows}
+
+    def get_buckets(self, chat_id, period, first, last):
+        result = {}
+        for bucket, user_id, hits in self._db().execute(SQL_GET_BUCKETS, (int(chat_id), period, first, last)):
+            result.setdefault(bucket, {})[str(user_id)] = hits
+        return result
+
+    def get_draws(self, chat_id):
+        rows = self._db().execute(SQL_GET_DRAWS, (int(chat_id),))
+        return [{"user_id": user_id, "ts": ts, "kind": kind} for user_id, ts, kind in rows]
+
+    # =============== ВЫГРУЗКА И ВОССТАНОВЛЕНИЕ ==================
+    # В режиме WAL читающая транзакция видит базу на момент первого
+    # запроса и не мешает писать процессу бота
+    @contextmanager
+    def read_snapshot(self):
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            yield
+        finally:
+            db.execute("COMMIT")
+
+    def iter_chats(self):
+        for (chat_id,) in self._db().execute(SQL_ALL_CHATS):
+            yield chat_id
+
+    def export_chat(self, chat_id):
+        # Участники читаются мимо ParticipantIndex: выгрузка всех чатов
+        # не должна оставлять их в памяти
+        record = super().export_chat(chat_id)
+        record["users"] = {str(u): seen for u, seen in self._load_participants(chat_id).items()}
+        return record
+
+    def iter_draws(self, chat_ids=None):
+        if chat_ids:
+            yield from super().iter_draws(chat_ids)
+            return
+        for chat_id, user_id, ts, kind in self._db().execute(SQL_ALL_DRAWS):
+            yield {"chat_id": chat_id, "user_id": user_id, "ts": ts, "kind": kind}
+
+    def restore_chat(self, record):
+        chat_id = int(record["chat_id"])
+        users = {int(u): seen for u, seen in record.get("users", {}).items()}
+        db = self._db()
+        with db:
+            for table in STATE_TABLES:
+                db.execute(f"DELETE FROM {table} WHERE chat_id = ?", (chat_id,))
+            db.executemany(SQL_TOUCH_USER, [(chat_id, u, seen) for u, seen in users.items()])
+            db.executemany(SQL_SET_SETTING, [
+                (chat_id, key, json.dumps(value, ensure_ascii=False))
+                for key, value in record.get("settings", {}).items()
+            ])
+            db.executemany(SQL_ADD_PHRASE, [(chat_id, p) for p in record.get("custom_phrases", [])])
+            db.executemany(SQL_INCREMENT_STAT, [
+                (chat_id, int(u), hits) for u, hits in record.get("stats", {}).items()
+            ])
+            db.executemany(SQL_INCREMENT_BUCKET, [
+                (chat_id, period, bucket, int(u), hits)
+                for period, by_bucket in record.get("draw_buckets", {}).items()
+                for bucket, hits_by_user in by_bucket.items()
+                for u, hits in hits_by_user.items()
+            ])
+        self.participants.replace(chat_id, users)
+
+    def replace_draws(self, chat_ids, draws):
+        # Одной транзакцией; executemany берёт записи из итератора по одной
+        db = self._db()
+        with db:
+            db.executemany("DELETE FROM draws WHERE chat_id = ?", [(int(chat_id),) for chat_id in chat_ids])
+            db.executemany(SQL_ADD_DRAW, ((d["chat_id"], d["user_id"], d["ts"], d["kind"]) for d in draws))
+
+    def backup(self, dest):
+        # Онлайн-копия средствами SQLite (постранично, бот продолжает писать)
+        target = sqlite3.connect(dest)
+        try:
+            self._db().backup(target)
+        finally:
+            target.close()
+        return [dest]
+
+
+def import_json_documents(conn, source, today):
+    # Разовый перенос содержимого JSON-документов в таблицы SQLite;
+    # участникам в старом формате (списком) днём активности ставится today
+    counts = {}
+    with conn:
+        users = source.doc("users")
+        for chat_id, members in users.items():
+            if isinstance(members, list):
+                members = {u: today for u in members}
+            conn.executemany(SQL_TOUCH_USER, [
+                (int(chat_id), int(u), seen) for u, seen in members.items()
+            ])
+        counts["users"] = sum(len(v) for v in users.values())
+
+        settings = source.doc("settings")
+        for chat_id, chat_settings in settings.items():
+            conn.executemany(SQL_SET_SETTING, [
+                (int(chat_id), key, json.dumps(value, ensure_ascii=False))
+                for key, value in chat_settings.items()
+            ])
+        counts["settings"] = len(settings)
+
+        phrases = source.doc("custom_phrases")
+        for chat_id, chat_phrases in phrases.items():
+            conn.executemany(SQL_ADD_PHRASE, [(int(chat_id), p) for p in chat_phrases])
+        counts["custom_phrases"] = sum(len(v) for v in phrases.values())
+
+        stats = source.doc("stats")
+        for chat_id, chat_stats in stats.items():
+            conn.executemany(SQL_INCREMENT_STAT, [
+                (int(chat_id), int(user_id), hits) for user_id, hits in chat_stats.items()
+            ])
+        counts["stats"] = len(stats)
+
+        buckets = source.doc("draw_buckets") if "draw_buckets" in source.files else {}
+        for chat_id, periods in buckets.items():
+            for period, by_bucket in periods.items():
+                conn.executemany(SQL_INCREMENT_BUCKET, [
+                    (int(chat_id), period, bucket, int(user_id), hits)
+                    for bucket, hits_by_user in by_bucket.items()
+                    for user_id, hits in hits_by_user.items()
+                ])
+        draws = source.read_log("draws") if "draws" in source.logs else []
+        conn.executemany(SQL_ADD_DRAW, [
+            (r["chat_id"], r["user_id"], r["ts"], r["kind"]) for r in draws
+        ])
+        counts["draws"] = len(draws)
+    return counts
@@ -0,0 +1,282 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import nullcontext
+
+from metrics import STORAGE_BYTES, STORAGE_SECONDS
+from storage.journal import JOURNAL_SEQ_KEY, Journal, apply_op, fsync_dir
+
+# =============== JSON-УТИЛИТЫ ==================
+def load_json(file, default=None):
+    if default is None:
+        default = {}
+    try:
+        if not os.path.exists(file):
+            return default
+        started = time.perf_counter()
+        with open(file, "r", encoding="utf-8") as f:
+            text = f.read()
+        data = json.loads(text)
+        STORAGE_SECONDS.observe(time.perf_counter() - started, op="load")
+        STORAGE_BYTES.inc(len(text), op="load")
+        return data
+    except Exception as e:
+        logging.error(f"Ошибка чтения {file}: {e}")
+        return default
+
+def save_json(file, data):
+    try:
+        started = time.perf_counter()
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+        with open(file, "w", encoding="utf-8") as f:
+            f.write(text)
+        STORAGE_SECONDS.observe(time.perf_counter() - started, op="save")
+        STORAGE_BYTES.inc(len(text), op="save")
+    except Exception as e:
+        logging.error(f"Ошибка записи {file}: {e}")
+
+def write_atomic(file, text):
+    # Пишем во временный файл и подменяем им оригинал: читатель никогда не
+    # увидит наполовину записанный JSON.
+    started = time.perf_counter()
+    tmp = f"{file}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file)
+    fsync_dir(file)
+    STORAGE_SECONDS.observe(time.perf_counter() - started, op="snapshot")
+    STORAGE_BYTES.inc(len(text), op="snapshot")
+
+# =============== ХРАНИЛИЩЕ СОСТОЯНИЯ ==================
+class StateStore:
+    # Держит JSON-документы в памяти процесса и сбрасывает изменения
+    # на диск в фоне (write-behind): раз в flush_interval секунд и при остановке.
+    #
+    # Без журнала изменённый документ переписывается целиком. С журналом
+    # (journal=True) каждое изменение дописывается маленькой записью в
+    # <файл>.journal, а полный снимок пишется, только когда журнал
+    # перерастёт compact_bytes; при старте журнал проигрывается поверх снимка.
+    #
+    # logs — файлы, которые только дописываются (история жеребьёвок):
+    # записи копятся в памяти и уходят на диск тем же фоновым сбросом.
+    #
+    # lock — межпроцессная блокировка (storage.filelock.FileLock): под ней
+    # документы читаются при загрузке и пишутся при сбросе, чтобы другой
+    # процесс не застал снимок и журнал на полпути.
+
+    def __init__(self, files, flush_interval=5.0, journal=False, compact_bytes=1024 * 1024, logs=None, lock=None):
+        self.files = dict(files)
+        self.logs = {name: Journal(path) for name, path in (logs or {}).items()}
+        self._log_pending = {}
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self.compact_bytes = compact_bytes
+        self._docs = {}
+        self._seq = {}
+        self._journals = {}
+        self._pending = {}
+        self._dirty = set()
+        self._write_lock = threading.Lock()
+        self._file_lock = lock or nullcontext()
+        self._flusher = None
+
+    def load(self):
+        for name in self.files:
+            self.doc(name)
+
+    def doc(self, name):
+        if name not in self._docs:
+            with self._file_lock:
+                self._docs[name] = self._recover(name)
+        return self._docs[name]
+
+    def _recover(self, name):
+        data = load_json(self.files[name])
+        seq = data.pop(JOURNAL_SEQ_KEY, 0)
+        journal_path = f"{self.files[name]}.journal"
+        if self.journal or os.path.exists(journal_path):
+            journal = self._journals[name] = Journal(journal_path)
+            replayed = 0
+            for rec_seq, op, path, value in journal.read():
+                if rec_seq <= seq:
+                    continue
+                apply_op(data, op, path, value)
+                seq = rec_seq
+                replayed += 1
+            if replayed:
+                logging.info(f"{self.files[name]}: из журнала восстановлено {replayed} изменений")
+                if not self.journal:
+                    # Журнал остался от прошлого режима — переносим его в снимок
+                    self._dirty.add(name)
+        self._seq[name] = seq
+        return data
+
+    def apply(self, name, op, path, value=None):
+        path = [str(part) for part in path]
+        result = apply_op(self.doc(name), op, path, value)
+        if self.journal:
+            self._seq[name] += 1
+            record = [self._seq[name], op, path, value]
+            self._pending.setdefault(name, []).append(json.dumps(record, ensure_ascii=False))
+        else:
+            self._dirty.add(name)
+        return result
+
+    def load_snapshot(self):
+        # Все документы и логи одним срезом под межпроцессной блокировкой:
+        # другой процесс не сбросит свои изменения между чтениями.
+        # Логи не читаются: возвращаются их границы {имя лога: (байт на
+        # диске, ещё не сброшенные строки)} для iter_log.
+        with self._file_lock:
+            for name in self.files:
+                if name not in self._docs:
+                    self._docs[name] = self._recover(name)
+            return {name: (log.disk_size(), list(self._log_pending.get(name, []))) for name, log in self.logs.items()}
+
+    def copy_files(self, dest_dir):
+        # Файлы на диске как есть (снимки, журналы, логи) под той же блокировкой
+        os.makedirs(dest_dir, exist_ok=True)
+        paths = [path for file in self.files.values() for path in (file, f"{file}.journal")]
+        paths += [journal.path for journal in self.logs.values()]
+        copied = []
+        with self._file_lock:
+            for path in paths:
+                if os.path.exists(path):
+                    copied.append(shutil.copy2(path, os.path.join(dest_dir, os.path.basename(path))))
+        return copied
+
+    def append_log(self, name, record):
+        self._log_pending.setdefault(name, []).append(json.dumps(record, ensure_ascii=False))
+
+    def read_log(self, name):
+        return list(self.iter_log(name))
+
+    def iter_log(self, name, bound=None):
+        # Записанное на диск плюс ещё не сброшенное, по одной записи;
+        # bound — граница из load_snapshot, иначе всё на текущий момент
+        limit, pending = bound if bound is not None else (None, list(self._log_pending.get(name, [])))
+        yield from self.logs[name].iter(limit)
+        for line in pending:
+            yield json.loads(line)
+
+    def replace_log(self, name, drop, records):
+        # Переписывает лог без записей, для которых drop(запись) истинно, и
+        # дописывает records (итератор). Файл читается и пишется потоком,
+        # под той же блокировкой, что и фоновый сброс.
+        with self._write_lock, self._file_lock:
+            self._log_pending[name] = [line for line in self._log_pending.get(name, []) if not drop(json.loads(line))]
+            log = self.logs[name]
+            kept = (json.dumps(r, ensure_ascii=False) for r in log.iter() if not drop(r))
+            added = (json.dumps(r, ensure_ascii=False) for r in records)
+            log.replace(itertools.chain(kept, added))
+
+    def mark_dirty(self, name):
+        # Документ изменили напрямую — следующий сброс запишет его целиком
+        self._dirty.add(name)
+
+    @property
+    def dirty(self):
+        return bool(self._dirty) or any(self._pending.values()) or any(self._log_pending.values())
+
+    def _snapshot_text(self, name):
+        data = self._docs[name]
+        if self.journal:
+            data = dict(data)
+            data[JOURNAL_SEQ_KEY] = self._seq[name]
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    # Сериализация выполняется в потоке цикла событий, пока документы никто
+    # не меняет; в фоновый поток уходит только готовый текст.
+    def _take_dirty(self):
+        with STORAGE_SECONDS.time(op="serialize"):
+            return self._collect_payloads()
+
+    def _collect_payloads(self):
+        payloads = []
+        for name in sorted(self._dirty | set(self._pending)):
+            lines = self._pending.pop(name, [])
+            if name not in self._dirty and not lines:
+                continue
+            journal = self._journals.get(name)
+            needs_snapshot = name in self._dirty or not self.journal
+            if not needs_snapshot:
+                pending_bytes = sum(len(line) + 1 for line in lines)
+                needs_snapshot = journal.size + pending_bytes > self.compact_bytes
+            if needs_snapshot:
+                payloads.append((name, "snapshot", self._snapshot_text(name)))
+            else:
+                payloads.append((name, "append", lines))
+        self._dirty.clear()
+        for name in sorted(self._log_pending):
+            lines = self._log_pending.pop(name)
+            if lines:
+                payloads.append((name, "log", lines))
+        return payloads
+
+    def _write(self, payloads):
+        failed = []
+        with self._write_lock, self._file_lock:
+            for name, kind, data in payloads:
+                try:
+                    if kind == "log":
+                        self.logs[name].append(data)
+                    elif kind == "append":
+                        self._journals[name].append(data)
+                    else:
+                        write_atomic(self.files[name], data)
+                        # Снимок уже содержит всё из журнала; если упадём до
+                        # очистки, записи с seq <= снимка при старте пропустятся.
+                        if name in self._journals:
+                            self._journals[name].truncate()
+                except Exception as e:
+                    path = self.logs[name].path if kind == "log" else self.files[name]
+                    logging.error(f"Ошибка записи {path}: {e}")
+                    failed.append((name, kind, data))
+        return failed
+
+    def _requeue(self, failed):
+        for name, kind, data in failed:
+            if kind == "log":
+                self._log_pending[name] = data + self._log_pending.get(name, [])
+            else:
+                # Несохранённый документ в следующий раз пишем полным снимком
+                self._dirty.add(name)
+
+    def flush(self):
+        self._requeue(self._write(self._take_dirty()))
+
+    async def flush_async(self):
+        payloads = self._take_dirty()
+        if not payloads:
+            return
+        self._requeue(await asyncio.to_thread(self._write, payloads))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logging.error(f"Ошибка фонового сохранения: {e}")
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self, flush=True):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if flush:
+            await self.flush_async()
@@ -0,0 +1,147 @@
+import asyncio
+import io
+import json
+import sqlite3
+
+import pytest
+
+import backup
+from backup import FORMAT_VERSION, export_state, import_state
+from sharding import shard_of
+from storage import JsonBackend, SqliteBackend, save_json
+
+@pytest.fixture
+def make_backend(state_files):
+    def make(kind, path):
+        path.mkdir(exist_ok=True)
+        files = state_files(path)
+        if kind == "sqlite":
+            backend = SqliteBackend(str(path / "bot.sqlite3"), json_files=files)
+        else:
+            backend = JsonBackend(files)
+        backend.load()
+        return backend
+    return make
+
+def fill(backend):
+    for chat_id in (-3, -2, -1):
+        backend.touch_user(chat_id, 10, 700000)
+        backend.touch_user(chat_id, 11, 700001)
+        backend.set_setting(chat_id, "last_run_date", "2025-06-20")
+        backend.add_custom_phrase(chat_id, f"фраза {chat_id}: {{mention}}")
+        backend.record_draw(chat_id, 10, "manual", 100.0, "2025-06-19")
+        backend.record_draw(chat_id, 11, "autorun", 200.0, "2025-06-20")
+
+@pytest.mark.parametrize("source_kind, target_kind", [
+    ("json", "json"), ("json", "sqlite"), ("sqlite", "json"), ("sqlite", "sqlite"),
+])
+def test_export_import_round_trip(tmp_path, source_kind, target_kind, make_backend):
+    source = make_backend(source_kind, tmp_path / "source")
+    fill(source)
+    out = io.StringIO()
+    assert export_state(source, out) == 3
+    dump = out.getvalue()
+
+    target = make_backend(target_kind, tmp_path / "target")
+    # В цели уже есть своя история чата: после восстановления её не остаётся,
+    # и статистика сходится с историей
+    target.record_draw(-1, 12, "manual", 50.0, "2025-06-18")
+    target.record_draw(-1, 12, "manual", 300.0, "2025-06-21")
+    target.record_draw(-5, 12, "manual", 300.0, "2025-06-21")
+    assert import_state(target, io.StringIO(dump)) == 3
+    # Повторное восстановление ничего не задваивает
+    assert import_state(target, io.StringIO(dump)) == 3
+    assert list(target.iter_chats()) == [-5, -3, -2, -1]
+    for chat_id in (-3, -2, -1):
+        assert target.export_chat(chat_id) == source.export_chat(chat_id)
+        assert target.get_draws(chat_id) == source.get_draws(chat_id)
+    assert len(target.get_draws(-5)) == 1
+    asyncio.run(source.close())
+    asyncio.run(target.close())
+
+def test_chat_filter_on_export_and_import(tmp_path, make_backend):
+    source = make_backend("json", tmp_path / "source")
+    fill(source)
+    out = io.StringIO()
+    export_state(source, out, chat_ids=[-2])
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 4 and all('"chat_id":-2' in line for line in lines[1:])
+
+    full = io.StringIO()
+    export_state(source, full)
+    target = make_backend("sqlite", tmp_path / "target")
+    assert import_state(target, io.StringIO(full.getvalue()), chat_ids=[-1]) == 1
+    assert list(target.iter_chats()) == [-1]
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_history_exported_after_chats_from_snapshot(tmp_path, kind, make_backend):
+    backend = make_backend(kind, tmp_path / "live")
+    fill(backend)
+    asyncio.run(backend.close())  # история на диске, как у работающего бота
+    out = io.StringIO()
+    with backend.read_snapshot():
+        snapshot = list(backend.iter_draws())
+        # Записанное после начала среза (другим процессом) в него не попадает
+        writer = make_backend(kind, tmp_path / "live")
+        writer.record_draw(-1, 10, "manual", 900.0, "2025-06-21")
+        asyncio.run(writer.close())
+        assert list(backend.iter_draws()) == snapshot
+    assert len(snapshot) == 6
+    export_state(backend, out, chat_ids=[-2])
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert records[0]["version"] == FORMAT_VERSION
+    assert [r["chat_id"] for r in records[1:2]] == [-2] and "draws" not in records[1]
+    assert [r["draw"] for r in records[2:]] == [
+        {"chat_id": -2, "user_id": 10, "ts": 100.0, "kind": "manual"},
+        {"chat_id": -2, "user_id": 11, "ts": 200.0, "kind": "autorun"},
+    ]
+    asyncio.run(backend.close())
+
+def test_import_rejects_other_format_version(tmp_path, make_backend):
+    target = make_backend("json", tmp_path / "target")
+    header = json.dumps({"format": "victim_bot-state", "version": FORMAT_VERSION - 1})
+    with pytest.raises(ValueError):
+        import_state(target, io.StringIO(header + "\n"))
+
+def test_export_and_backup_do_not_write_data_dir(tmp_path, state_files):
+    data = tmp_path / "data"
+    data.mkdir()
+    files = state_files(data)
+    # Участники в старом формате (списком) — при чтении они переводятся только в памяти
+    save_json(files["users"], {"-1": [10, 11]})
+    save_json(files["settings"], {"-1": {"last_run_date": "2025-06-20"}})
+    before = {path.name: path.read_bytes() for path in data.iterdir()}
+    for argv in (["export", "-o", str(tmp_path / "state.ndjson")], ["backup", str(tmp_path / "copy")]):
+        assert backup.main(argv, JsonBackend(files, journal=True)) == 0
+    assert {path.name: path.read_bytes() for path in data.iterdir()} == before
+    assert '"users":{"10":' in (tmp_path / "state.ndjson").read_text(encoding="utf-8")
+
+def test_sqlite_backup_while_writing(tmp_path, make_backend):
+    backend = make_backend("sqlite", tmp_path / "live")
+    fill(backend)
+    dest = str(tmp_path / "copy.sqlite3")
+    with backend.read_snapshot():
+        # Чтение из среза не видит записи, сделанные после его начала
+        before = backend.export_chat(-1)
+        writer = SqliteBackend(backend.path)
+        writer.set_setting(-1, "runs_today", 5)
+        assert backend.export_chat(-1) == before
+        asyncio.run(writer.close())
+    backend.backup(dest)
+    rows = sqlite3.connect(dest).execute("SELECT value FROM settings WHERE chat_id = -1 AND key = 'runs_today'")
+    assert rows.fetchall() == [("5",)]
+    asyncio.run(backend.close())
+
+def test_import_keeps_only_own_shard(tmp_path, make_backend):
+    source = make_backend("json", tmp_path / "source")
+    fill(source)
+    out = io.StringIO()
+    export_state(source, out)
+    shards = [make_backend("sqlite", tmp_path / f"shard-{i}") for i in range(2)]
+    for index, shard in enumerate(shards):
+        import_state(shard, io.StringIO(out.getvalue()), owns=lambda chat_id: shard_of(chat_id, 2) == index)
+    chats = [list(shard.iter_chats()) for shard in shards]
+    assert sorted(chats[0] + chats[1]) == [-3, -2, -1]
+    assert all(shard_of(chat_id, 2) == index for index, shard_chats in enumerate(chats) for chat_id in shard_chats)
+    for backend in [source] + shards:
+        asyncio.run(backend.close())
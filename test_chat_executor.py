@@ -0,0 +1,44 @@
+import asyncio
+
+from chat_executor import ChatExecutor
+
+
+def test_same_chat_runs_in_order_other_chats_in_parallel():
+    async def scenario():
+        executor = ChatExecutor()
+        log = []
+
+        async def job(name, delay):
+            log.append(f"start {name}")
+            await asyncio.sleep(delay)
+            log.append(f"end {name}")
+
+        await asyncio.gather(
+            executor.run(1, job, "a1", 0.03),
+            executor.run(1, job, "a2", 0.0),
+            executor.run(2, job, "b1", 0.01),
+        )
+        return log, len(executor)
+
+    log, remaining = asyncio.run(scenario())
+    # a2 ждёт окончания a1, а b1 из другого чата — нет
+    assert log.index("end a1") < log.index("start a2")
+    assert log.index("end b1") < log.index("end a1")
+    # Незанятые замки удаляются
+    assert remaining == 0
+
+def test_lock_released_on_error():
+    async def scenario():
+        executor = ChatExecutor()
+
+        async def fail():
+            raise RuntimeError
+
+        try:
+            await executor.run("1", fail)
+        except RuntimeError:
+            pass
+        async with executor.lock(1):
+            return len(executor)
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,15 @@
+from datetime import datetime
+
+import pytz
+
+from dayclock import DayClock
+
+def test_day_rolls_over_at_local_midnight():
+    tz = pytz.timezone("Europe/Moscow")
+    now = [tz.localize(datetime(2025, 6, 20, 23, 59, 59)).timestamp()]
+    clock = DayClock(tz, clock=lambda: now[0])
+    assert clock.today() == "2025-06-20"
+    assert clock.bucket() == datetime(2025, 6, 20).toordinal()
+    now[0] += 1
+    assert clock.today() == "2025-06-21"
+    assert clock.date() == datetime(2025, 6, 21).date()
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from mentions import MentionCache, format_mention, resolve_mentions
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_format_mention():
+    assert format_mention(SimpleNamespace(id=1, username="vasya", full_name="Vasya")) == "@vasya"
+    assert format_mention(SimpleNamespace(id=1, username=None, full_name="A <b>")) == "A &lt;b&gt;"
+    assert format_mention(SimpleNamespace(id=1, username=None, full_name="")) == "User 1"
+
+def test_cache_ttl_and_counters():
+    clock = FakeClock()
+    cache = MentionCache(maxsize=10, ttl=60, clock=clock)
+    assert cache.get(1, 10) is None
+    cache.put(1, 10, "@a")
+    assert cache.get(1, 10) == "@a"
+    clock.now = 61
+    assert cache.get(1, 10) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+def test_cache_lru_eviction_and_invalidation():
+    cache = MentionCache(maxsize=2, ttl=60)
+    cache.put(1, 10, "@a")
+    cache.put(1, 11, "@b")
+    cache.get(1, 10)
+    cache.put(2, 20, "@c")
+    # Вытеснена самая давно использованная запись
+    assert cache.get(1, 11) is None
+    assert cache.get(1, 10) == "@a"
+    cache.invalidate(1, 10)
+    assert cache.get(1, 10) is None
+    cache.invalidate(2)
+    assert len(cache) == 0
+
+def test_resolve_mentions_concurrent_with_fallback():
+    import asyncio
+
+    from aiogram.exceptions import TelegramRetryAfter
+    from aiogram.methods import GetChatMember
+
+    active = 0
+    peak = 0
+    flooded = set()
+
+    async def lookup(user_id):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            if user_id == 2 and user_id not in flooded:
+                flooded.add(user_id)
+                raise TelegramRetryAfter(GetChatMember(chat_id=1, user_id=2), "flood", 0)
+            if user_id == 3:
+                await asyncio.sleep(10)
+            await asyncio.sleep(0.01)
+            return f"@u{user_id}"
+        finally:
+            active -= 1
+
+    result = asyncio.run(resolve_mentions(lookup, [1, 2, 3, 4, 5], concurrency=2, timeout=0.2))
+    assert result == ["@u1", "@u2", "User 3", "@u4", "@u5"]
+    assert peak <= 2
@@ -0,0 +1,51 @@
+import asyncio
+
+from aiohttp import ClientSession
+
+from metrics import STORAGE_CALL_SECONDS, STORAGE_SECONDS, Registry, start_metrics_server
+from storage import InstrumentedBackend, JsonBackend
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    draws = registry.counter("draws_total", "Жеребьёвки")
+    timings = registry.summary("handler_seconds", "Время")
+    registry.gauge("cache", "Кэш", lambda: {"hits": 3, "misses": 1}, label="stat")
+    draws.inc(kind="manual")
+    draws.inc(kind="manual")
+    with timings.time(handler="/victim"):
+        pass
+    text = registry.render()
+    assert "# TYPE draws_total counter" in text
+    assert 'draws_total{kind="manual"} 2' in text
+    assert 'handler_seconds_count{handler="/victim"} 1' in text
+    assert 'cache{stat="hits"} 3' in text
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("c", "c").inc(error='bad "quote"\nline')
+    assert 'c{error="bad \\"quote\\"\\nline"} 1' in registry.render()
+
+def test_metrics_endpoint():
+    async def scenario():
+        registry = Registry()
+        registry.counter("up", "up").inc()
+        runner = await start_metrics_server("127.0.0.1", 0, registry)
+        port = runner.addresses[0][1]
+        async with ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                body = await resp.text()
+        await runner.cleanup()
+        return body
+
+    assert "up 1" in asyncio.run(scenario())
+
+def test_backend_calls_and_file_io_timed_separately(files):
+    # Вызов бэкенда включает файловые операции — они в разных метриках
+    backend = InstrumentedBackend(JsonBackend(files))
+    calls, file_ops = STORAGE_CALL_SECONDS.count(op="json.set_setting"), STORAGE_SECONDS.count(op="snapshot")
+    backend.set_setting(1, "runs_today", 1)
+    asyncio.run(backend.close())
+    assert STORAGE_CALL_SECONDS.count(op="json.set_setting") == calls + 1
+    assert STORAGE_SECONDS.count(op="snapshot") > file_ops
+    assert STORAGE_SECONDS.count(op="json.set_setting") == 0
@@ -0,0 +1,119 @@
+import asyncio
+
+from scheduler import DeadlineScheduler, jitter_for
+
+
+def test_pop_due_in_deadline_order_and_reschedule():
+    s = DeadlineScheduler(clock=lambda: 100)
+    s.schedule("a", 50)
+    s.schedule("b", 10)
+    s.schedule("c", 500)
+    s.schedule("a", 20)
+    assert s.next_due() == 10
+    assert s.pop_due(100) == ["b", "a"]
+    assert s.pop_due(100) == []
+    s.cancel("c")
+    assert s.next_due() is None
+    assert len(s) == 0
+
+def test_run_sleeps_until_earliest_and_wakes_on_earlier_deadline():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        s = DeadlineScheduler(clock=loop.time)
+        fired = []
+
+        async def callback(chat_id):
+            fired.append((chat_id, loop.time()))
+            if chat_id == "boom":
+                raise RuntimeError("ошибка одного чата не должна останавливать цикл")
+
+        s.schedule("late", loop.time() + 10)
+        task = asyncio.create_task(s.run(callback))
+        await asyncio.sleep(0.01)
+        start = loop.time()
+        s.schedule("boom", start + 0.02)
+        s.schedule("soon", start + 0.05)
+        await asyncio.sleep(0.15)
+        task.cancel()
+        return start, fired
+
+    start, fired = asyncio.run(scenario())
+    assert [chat_id for chat_id, _ in fired] == ["boom", "soon"]
+    assert fired[1][1] - start >= 0.05
+
+def test_pool_bounds_concurrency_and_isolates_slow_chats():
+    async def scenario():
+        s = DeadlineScheduler(clock=lambda: 1000, workers=3, retry_after=60)
+        running = []
+        peak = [0]
+        done = []
+
+        async def callback(chat_id):
+            running.append(chat_id)
+            peak[0] = max(peak[0], len(running))
+            await asyncio.sleep(0.2 if chat_id == "slow" else 0.01)
+            running.remove(chat_id)
+            done.append(chat_id)
+            if chat_id == "c3":
+                raise RuntimeError("ошибка одного чата")
+
+        await s.run_batch(["slow"] + [f"c{i}" for i in range(8)], callback)
+        return peak[0], done, s
+
+    peak, done, s = asyncio.run(scenario())
+    assert peak == 3
+    # Упавший чат не выпал из плана, а повторится через retry_after
+    assert s.due_at("c3") == 1060 and len(s) == 1
+    # Медленный чат занял одно место, остальные прошли мимо него
+    assert done[-1] == "slow" and len(done) == 9
+
+def test_run_caps_chats_per_tick():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        s = DeadlineScheduler(clock=loop.time, workers=10, per_tick=4, tick_interval=0.1)
+        fired = []
+
+        async def callback(chat_id):
+            fired.append((chat_id, loop.time()))
+
+        for i in range(10):
+            s.schedule(i, loop.time() - 1)
+        start = loop.time()
+        task = asyncio.create_task(s.run(callback))
+        await asyncio.sleep(0.35)
+        task.cancel()
+        return start, fired, s.ticks
+
+    start, fired, ticks = asyncio.run(scenario())
+    assert len(fired) == 10 and ticks == 3
+    assert fired[4][1] - start >= 0.1 and fired[8][1] - start >= 0.2
+
+def test_jitter_is_deterministic_and_within_window():
+    values = [jitter_for(-1000000000000 - i, 600) for i in range(200)]
+    assert values == [jitter_for(-1000000000000 - i, 600) for i in range(200)]
+    assert all(0 <= v < 600 for v in values)
+    assert len({int(v // 60) for v in values}) == 10
+    assert jitter_for(1, 0) == 0.0
+
+def test_cancelled_run_waits_for_inflight_chats():
+    async def scenario():
+        s = DeadlineScheduler(clock=lambda: 1000)
+        finished = []
+
+        async def callback(chat_id):
+            try:
+                await asyncio.sleep(10)
+            finally:
+                # Отмена застала чат посреди работы: он доделывает её
+                await asyncio.sleep(0.01)
+                finished.append(chat_id)
+
+        s.schedule("c1", 0)
+        task = asyncio.create_task(s.run(callback))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Когда run() завершён, отменённый чат уже закончил работу
+        return finished
+
+    assert asyncio.run(scenario()) == ["c1"]
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from sender import PRIORITY_AUTORUN, PRIORITY_INTERACTIVE, SendQueue, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, capacity=2, clock=clock)
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == pytest.approx(1.0)
+    clock.now = 0.5
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now = 10
+    assert bucket.full
+
+def test_interactive_replies_go_first():
+    async def scenario():
+        queue = SendQueue(workers=1)
+        sent = []
+
+        async def deliver(text):
+            sent.append(text)
+            return text
+
+        queue.start()
+        # Пока единственный обработчик занят, в очереди копятся оба сообщения
+        blocker = asyncio.create_task(queue.send(1, lambda: asyncio.sleep(0.01)))
+        await asyncio.sleep(0)
+        autorun = asyncio.create_task(queue.send(2, lambda: deliver("autorun"), PRIORITY_AUTORUN))
+        interactive = asyncio.create_task(queue.send(3, lambda: deliver("reply"), PRIORITY_INTERACTIVE))
+        await asyncio.gather(blocker, autorun, interactive)
+        await queue.close()
+        return sent
+
+    assert asyncio.run(scenario()) == ["reply", "autorun"]
+
+def test_retry_after_and_failures_reach_caller():
+    async def scenario():
+        queue = SendQueue()
+        calls = 0
+
+        async def flaky():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "flood", 0)
+            return "ok"
+
+        async def broken():
+            raise RuntimeError("chat not found")
+
+        assert await queue.send(1, flaky) == "ok"
+        with pytest.raises(RuntimeError):
+            await queue.send(1, broken)
+        stats = queue.stats()
+        await queue.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["sent"] == 1
+    assert stats["retried"] == 1
+    assert stats["failed"] == 1
+
+def test_cancelled_caller_during_flood_does_not_kill_worker():
+    async def scenario():
+        queue = SendQueue(workers=1, max_retries=0)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def flooded():
+            started.set()
+            await release.wait()
+            raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "flood", 0)
+
+        async def ok():
+            return "ok"
+
+        caller = asyncio.create_task(queue.send(1, flooded))
+        await started.wait()
+        # Вызывающего отменили, пока запрос висит в 429 (потеря аренды и т. п.)
+        caller.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        result = await asyncio.wait_for(queue.send(2, ok), 1)
+        await queue.close()
+        return result, queue.stats()["failed"]
+
+    assert asyncio.run(scenario()) == ("ok", 1)
+
+def test_per_chat_limit_does_not_block_other_chats():
+    async def scenario():
+        queue = SendQueue(chat_per_minute=1, workers=1)
+        order = []
+
+        async def deliver(text):
+            order.append(text)
+
+        await queue.send(1, lambda: deliver("chat1-first"))
+        throttled = asyncio.create_task(queue.send(1, lambda: deliver("chat1-second")))
+        await asyncio.sleep(0)
+        await queue.send(2, lambda: deliver("chat2"))
+        assert queue.depth == 1
+        throttled.cancel()
+        await queue.close()
+        return order
+
+    assert asyncio.run(scenario()) == ["chat1-first", "chat2"]
+
+def test_closed_queue_refuses_sends():
+    async def scenario():
+        queue = SendQueue(chat_per_minute=1, workers=1)
+
+        async def deliver():
+            return "ok"
+
+        assert await queue.send(1, deliver) == "ok"
+        # Второе сообщение в чат ждёт лимита, когда очередь закрывают
+        throttled = asyncio.create_task(queue.send(1, deliver))
+        await asyncio.sleep(0)
+        await queue.close()
+        # Ожидавший не висит до конца лимита, а сразу получает ошибку
+        with pytest.raises(RuntimeError):
+            await throttled
+        with pytest.raises(RuntimeError):
+            await queue.send(2, deliver)
+        assert not queue._tasks and queue.depth == 0
+
+    asyncio.run(scenario())
+
+def test_chat_buckets_keyed_by_int_and_evicted_lru():
+    clock = FakeClock()
+    queue = SendQueue(chat_per_minute=1, clock=clock, max_chats=2)
+    assert queue._chat_bucket("-5") is queue._chat_bucket(-5)
+    queue._chat_bucket(-5).take()
+    queue._chat_bucket(-6).take()
+    # Обе корзины не полны — вытеснять нельзя, иначе чат получил бы лимит заново
+    queue._chat_bucket(-7)
+    assert list(queue._chats) == [-5, -6, -7]
+    clock.now += 120
+    queue._chat_bucket(-6)
+    queue._chat_bucket(-8)
+    assert list(queue._chats) == [-6, -8]
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import multiprocessing
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from sharding import ShardLease, build_router, hold_data_dir, shard_of, update_chat_id
+from storage import FileLock, JsonBackend
+
+def test_shard_of_is_stable_and_spreads_chats():
+    assert shard_of(-1001234567890, 1) == 0
+    assert shard_of(-1001234567890, 4) == shard_of(-1001234567890, 4)
+    counts = [0] * 4
+    for chat_id in range(-100000, -99000):
+        counts[shard_of(chat_id, 4)] += 1
+    assert all(150 < count < 350 for count in counts)
+
+def test_update_chat_id():
+    message = {"chat": {"id": -5}, "from": {"id": 7}}
+    assert update_chat_id({"update_id": 1, "message": message}) == -5
+    assert update_chat_id({"update_id": 2, "callback_query": {"from": {"id": 7}, "message": message}}) == -5
+    assert update_chat_id({"update_id": 3, "inline_query": {"from": {"id": 7}, "query": ""}}) == 7
+
+def test_lease_expires_and_moves_to_another_owner(tmp_path):
+    now = [1000.0]
+    path = str(tmp_path / "scheduler.lease")
+    first = ShardLease(path, "a", ttl=30, clock=lambda: now[0])
+    second = ShardLease(path, "b", ttl=30, clock=lambda: now[0])
+    assert first.try_acquire() is True
+    assert second.try_acquire() is False
+    now[0] += 20
+    assert first.try_acquire() is True  # продление
+    now[0] += 40
+    assert second.try_acquire() is True
+    assert first.try_acquire() is False
+    second.release()
+    assert first.try_acquire() is True
+
+def _contend_for_lease(path, owner, start, results):
+    start.wait()
+    results.put((owner, ShardLease(path, owner, ttl=60).try_acquire()))
+
+def _increment_under_lock(path, times):
+    lock = FileLock(f"{path}.lock")
+    for _ in range(times):
+        with lock:
+            with open(path, "r", encoding="utf-8") as f:
+                value = int(f.read())
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(str(value + 1))
+
+def test_processes_agree_on_single_owner_and_locked_writes(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    path = str(tmp_path / "scheduler.lease")
+    start = ctx.Event()
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_contend_for_lease, args=(path, f"w{i}", start, results)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    outcomes = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join()
+    winners = [owner for owner, acquired in outcomes if acquired]
+    assert len(winners) == 1
+    with open(path, "r", encoding="utf-8") as f:
+        assert json.load(f)["owner"] == winners[0]
+
+    counter = str(tmp_path / "counter")
+    with open(counter, "w", encoding="utf-8") as f:
+        f.write("0")
+    workers = [ctx.Process(target=_increment_under_lock, args=(counter, 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    with open(counter, "r", encoding="utf-8") as f:
+        assert f.read() == "200"
+
+def test_lease_restarts_failed_task(tmp_path):
+    lease = ShardLease(str(tmp_path / "scheduler.lease"), "a", ttl=0.03)
+    starts = []
+
+    async def factory():
+        starts.append(len(starts))
+        if len(starts) == 1:
+            raise RuntimeError("планировщик упал")
+        await asyncio.Event().wait()
+
+    async def scenario():
+        holder = asyncio.create_task(lease.hold(factory))
+        await asyncio.sleep(0.1)
+        holder.cancel()
+        await asyncio.gather(holder, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert starts == [0, 1]
+    assert not lease.held
+
+def test_second_process_waits_for_data_dir(tmp_path):
+    async def scenario():
+        first = await hold_data_dir(str(tmp_path))
+        second = asyncio.create_task(hold_data_dir(str(tmp_path)))
+        await asyncio.sleep(0.2)
+        assert not second.done()
+        first.release()
+        (await asyncio.wait_for(second, 1)).release()
+
+    asyncio.run(scenario())
+
+def test_state_store_writes_under_file_lock(tmp_path, files):
+    backend = JsonBackend(files, lock=FileLock(str(tmp_path / "state.lock")))
+    backend.load()
+    backend.set_setting(1, "runs_today", 1)
+    other = FileLock(str(tmp_path / "state.lock"))
+
+    async def scenario():
+        # Пока блокировку держит «другой процесс», сброс ждёт
+        assert other.acquire(blocking=False) is True
+        flush = asyncio.create_task(backend.close())
+        await asyncio.sleep(0.2)
+        assert not flush.done() and not os.path.exists(files["settings"])
+        other.release()
+        await flush
+
+    asyncio.run(scenario())
+    with open(files["settings"], encoding="utf-8") as f:
+        assert json.load(f) == {"1": {"runs_today": 1}}
+
+def test_router_forwards_by_chat_shard():
+    received = {0: [], 1: []}
+
+    def shard_app(index):
+        async def handle(request):
+            received[index].append(update_chat_id(await request.json()))
+            return web.Response()
+        app = web.Application()
+        app.router.add_post("/webhook", handle)
+        return app
+
+    async def scenario():
+        async with TestServer(shard_app(0)) as s0, TestServer(shard_app(1)) as s1:
+            targets = [str(s0.make_url("")), str(s1.make_url(""))]
+            async with TestClient(TestServer(build_router(targets, "/webhook"))) as client:
+                for chat_id in range(-110, -100):
+                    update = {"update_id": 1, "message": {"chat": {"id": chat_id}, "from": {"id": 1}}}
+                    resp = await client.post("/webhook", json=update)
+                    assert resp.status == 200
+
+    asyncio.run(scenario())
+    for index, chats in received.items():
+        assert chats and all(shard_of(chat_id, 2) == index for chat_id in chats)
+    assert len(received[0]) + len(received[1]) == 10
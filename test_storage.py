@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from storage import JsonBackend, SqliteBackend, StateStore, load_json, save_json
+from storage.participants import active_since
+
+
+def test_state_store_loads_once_and_flushes(files):
+    save_json(files["users"], {"1": [10]})
+    store = StateStore(files)
+    store.load()
+    # Повторные чтения идут из памяти, а не с диска
+    os.remove(files["users"])
+    assert store.doc("users") == {"1": [10]}
+
+    store.doc("users")["1"].append(11)
+    store.mark_dirty("users")
+    assert store.dirty
+    store.flush()
+    assert not store.dirty
+    assert load_json(files["users"]) == {"1": [10, 11]}
+    # Нетронутые документы не переписываются
+    assert not os.path.exists(files["stats"])
+
+def test_state_store_flushes_on_close(files):
+    async def scenario():
+        store = StateStore(files, flush_interval=3600)
+        store.start()
+        store.doc("stats")["1"] = {"10": 1}
+        store.mark_dirty("stats")
+        await store.close()
+
+    asyncio.run(scenario())
+    with open(files["stats"], encoding="utf-8") as f:
+        assert json.load(f) == {"1": {"10": 1}}
+
+def test_journal_appends_and_recovers(files):
+    save_json(files["stats"], {"1": {"10": 5}})
+    store = StateStore(files, journal=True)
+    store.apply("stats", "incr", [1, 10], 1)
+    store.apply("stats", "incr", [2, 20], 1)
+    store.flush()
+    # Снимок не тронут, изменения лежат в журнале
+    assert load_json(files["stats"]) == {"1": {"10": 5}}
+    assert os.path.getsize(files["stats"] + ".journal") > 0
+
+    restored = StateStore(files, journal=True)
+    assert restored.doc("stats") == {"1": {"10": 6}, "2": {"20": 1}}
+
+def test_journal_compaction_is_not_replayed_twice(files):
+    store = StateStore(files, journal=True, compact_bytes=1)
+    store.apply("stats", "set", [1, "runs_today"], 3)
+    store.flush()
+    assert os.path.getsize(files["stats"] + ".journal") == 0
+    snapshot = load_json(files["stats"])
+    assert snapshot["1"] == {"runs_today": 3}
+
+    # Сбой между записью снимка и очисткой журнала: старые записи
+    # не должны примениться повторно
+    store.apply("stats", "incr", [1, "hits"], 1)
+    store.compact_bytes = 1024 * 1024
+    store.flush()
+    with open(files["stats"] + ".journal", encoding="utf-8") as f:
+        journal = f.read()
+    store.compact_bytes = 1
+    store.apply("stats", "incr", [1, "hits"], 1)
+    store.flush()
+    with open(files["stats"] + ".journal", "w", encoding="utf-8") as f:
+        f.write(journal)
+    assert StateStore(files, journal=True).doc("stats")["1"]["hits"] == 2
+
+def test_journal_skips_torn_tail(files):
+    store = StateStore(files, journal=True)
+    store.apply("users", "append", [1], 10)
+    store.flush()
+    with open(files["users"] + ".journal", "a", encoding="utf-8") as f:
+        f.write('[2, "append", ["1"], 1')
+    assert StateStore(files, journal=True).doc("users") == {"1": [10]}
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, tmp_path, files):
+    if request.param == "sqlite":
+        b = SqliteBackend(str(tmp_path / "bot.sqlite3"), json_files=files)
+    else:
+        b = JsonBackend(files)
+    b.load()
+    yield b
+    asyncio.run(b.close())
+
+def test_backend_contract(backend):
+    assert backend.touch_user(1, 10, 100) is True
+    assert backend.touch_user(1, 10, 101) is False
+    backend.touch_user(2, 20, 100)
+    assert backend.get_users(1) == [10]
+    assert backend.get_participants(1) == {10: 101}
+    backend.set_users(1, [11, 12], 100)
+    assert backend.get_participants(1) == {11: 100, 12: 100}
+
+    backend.set_setting(1, "last_run_date", "2025-06-20")
+    backend.set_setting(1, "runs_today", 2)
+    assert backend.get_settings(1) == {"last_run_date": "2025-06-20", "runs_today": 2}
+    assert dict(backend.iter_settings()) == {"1": {"last_run_date": "2025-06-20", "runs_today": 2}}
+
+    backend.add_custom_phrase(1, "a {mention}")
+    backend.add_custom_phrase(1, "b {mention}")
+    assert backend.del_custom_phrase(1, 0) == "a {mention}"
+    assert backend.del_custom_phrase(1, 5) is None
+    assert backend.get_custom_phrases(1) == ["b {mention}"]
+
+    backend.record_draw(1, 10, "manual", 1000.0, "2025-06-20")
+    backend.record_draw(1, 10, "autorun", 2000.0, "2025-07-01")
+    backend.record_draw(1, 11, "manual", 3000.0, "2025-07-01")
+    assert backend.get_stats_for_chat(1) == {"10": 2, "11": 1}
+    assert backend.get_stats_for_chat(2) == {}
+    assert backend.get_buckets(1, "d", "2025-06-21", "2025-07-31") == {"2025-07-01": {"10": 1, "11": 1}}
+    assert backend.get_buckets(1, "m", "2025-06", "2025-06") == {"2025-06": {"10": 1}}
+    assert backend.get_draws(1) == [
+        {"user_id": 10, "ts": 1000.0, "kind": "manual"},
+        {"user_id": 10, "ts": 2000.0, "kind": "autorun"},
+        {"user_id": 11, "ts": 3000.0, "kind": "manual"},
+    ]
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_backend_loads_in_worker_thread(tmp_path, kind, files):
+    # main() загружает хранилище через asyncio.to_thread, а работает с ним
+    # поток event loop; документы JSON к этому моменту уже в памяти
+    save_json(files["settings"], {"1": {"runs_today": 1}})
+    if kind == "sqlite":
+        b = SqliteBackend(str(tmp_path / "bot.sqlite3"), json_files=files)
+    else:
+        b = JsonBackend(files)
+
+    async def scenario():
+        await asyncio.to_thread(b.load)
+        os.remove(files["settings"])
+        assert b.get_settings(1) == {"runs_today": 1}
+        b.set_setting(1, "runs_today", 2)
+        assert b.get_settings(1) == {"runs_today": 2}
+        await b.close()
+
+    asyncio.run(scenario())
+
+def test_sqlite_imports_json_once(tmp_path, files):
+    save_json(files["users"], {"-100": [1, 2]})
+    save_json(files["stats"], {"-100": {"1": 3}})
+    save_json(files["settings"], {"-100": {"runs_today": 1}})
+    path = str(tmp_path / "bot.sqlite3")
+
+    # День переноса берётся у бота (его часовой пояс), а не у хоста
+    first = SqliteBackend(path, json_files=files, today=lambda: 700000)
+    first.load()
+    assert sorted(first.get_users(-100)) == [1, 2]
+    assert set(first.get_participants(-100).values()) == {700000}
+    assert first.get_stats_for_chat(-100) == {"1": 3}
+    asyncio.run(first.close())
+
+    second = SqliteBackend(path, json_files=files)
+    second.load()
+    assert second.get_stats_for_chat(-100) == {"1": 3}
+    asyncio.run(second.close())
+
+def test_touch_persists_only_on_new_day(files):
+    save_json(files["users"], {"1": [10, 11]})
+    backend = JsonBackend(files, today=lambda: 700000)
+    # Старый формат списком переводится в {user_id: день} текущим днём бота
+    assert backend.get_participants(1) == {10: 700000, 11: 700000}
+    backend.store.flush()
+
+    backend.touch_user(1, 10, 700000)
+    assert not backend.store.dirty
+    assert backend.add_user(1, 12) is True
+    backend.touch_user(1, 10, 700001)
+    assert backend.get_participants(1) == {10: 700001, 11: 700000, 12: 700000}
+
+def test_active_since():
+    assert active_since({1: 10, 2: 20, 3: 30}, 20) == [2, 3]
@@ -0,0 +1,40 @@
+import pytest
+
+from phrases.templates import PhrasePoolCache, PhraseTemplateError, compile_phrase, render_phrase
+from phrases.victim_phrases import VICTIM_PHRASES
+
+
+def test_compile_and_render():
+    parts = compile_phrase("<b>{mention}</b> & {{друзья}}")
+    assert render_phrase(parts, "@vasya") == "&lt;b&gt;@vasya&lt;/b&gt; &amp; {друзья}"
+
+@pytest.mark.parametrize("text", ["{mention", "привет {name}", "{mention!r}", "{mention:>10}", "{0}"])
+def test_bad_templates_rejected(text):
+    with pytest.raises(PhraseTemplateError):
+        compile_phrase(text)
+
+def test_phrase_without_mention_is_plain_text():
+    assert render_phrase(compile_phrase("Сегодня без жертв & {{скобки}}"), "@x") == "Сегодня без жертв &amp; {скобки}"
+
+def test_builtin_phrases_compile():
+    for phrase in VICTIM_PHRASES:
+        assert render_phrase(compile_phrase(phrase, escape=False), "@x") == phrase.format(mention="@x")
+
+def test_pool_is_cached_until_invalidated():
+    stored = {1: ["{mention}!", "сломанная {"]}
+    loads = []
+
+    def loader(chat_id):
+        loads.append(chat_id)
+        return stored.get(chat_id, [])
+
+    pools = PhrasePoolCache([], loader)
+    assert pools.custom(1) == (compile_phrase("{mention}!"),)
+    pools.custom(1)
+    assert pools.listing(1, lambda phrases: "\n".join(phrases)) == "{mention}!\nсломанная {"
+    assert loads == [1, 1]
+    stored[1] = ["{mention}?"]
+    pools.invalidate(1)
+    assert render_phrase(pools.choose(1), "@x") == "@x?"
+    # Пустой пул — фраза по умолчанию
+    assert render_phrase(pools.choose(2), "@x") == "@x — жертва дня!"
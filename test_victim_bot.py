@@ -1,73 +1,273 @@
-import os
-import json
-import random
-import shutil
-import pytest
-
-# Импортируем функции из victim_bot.py (если структура пакета позволяет)
-from victim_bot import (
-    save_json, load_json, get_users, set_users, add_user,
-    get_custom_phrases, add_custom_phrase, del_custom_phrase,
-    get_excluded, add_excluded, del_excluded,
-    increment_stat, get_stats_for_chat
-)
-
-TEST_CHAT_ID = 12345
-TEST_USER_ID = 999
-TEST_JSON = "test_file.json"
-
-@pytest.fixture(autouse=True)
-def cleanup():
-    # Очистка тестовых файлов перед/после теста
-    for fname in [
-        "stats.json", "users.json", "custom_phrases.json",
-        "exclude.json", "settings.json", "autorun.json"
-    ]:
-        if os.path.exists(fname):
-            os.remove(fname)
-    yield
-    for fname in [
-        "stats.json", "users.json", "custom_phrases.json",
-        "exclude.json", "settings.json", "autorun.json"
-    ]:
-        if os.path.exists(fname):
-            os.remove(fname)
-
-def test_json_save_and_load():
-    data = {"a": 1}
-    save_json(TEST_JSON, data)
-    loaded = load_json(TEST_JSON)
-    assert loaded == data
-    os.remove(TEST_JSON)
-
-def test_users():
-    set_users(TEST_CHAT_ID, [])
-    assert get_users(TEST_CHAT_ID) == []
-    add_user(TEST_CHAT_ID, TEST_USER_ID)
-    assert get_users(TEST_CHAT_ID) == [TEST_USER_ID]
-
-def test_phrases():
-    assert get_custom_phrases() == []
-    add_custom_phrase("Hello, test!")
-    phrases = get_custom_phrases()
-    assert "Hello, test!" in phrases
-    idx = phrases.index("Hello, test!")
-    assert del_custom_phrase(idx) is True
-    assert "Hello, test!" not in get_custom_phrases()
-
-def test_excluded():
-    assert get_excluded(TEST_CHAT_ID) == []
-    add_excluded(TEST_CHAT_ID, TEST_USER_ID)
-    assert get_excluded(TEST_CHAT_ID) == [TEST_USER_ID]
-    del_excluded(TEST_CHAT_ID, TEST_USER_ID)
-    assert get_excluded(TEST_CHAT_ID) == []
-
-def test_statistics():
-    increment_stat(TEST_CHAT_ID, TEST_USER_ID)
-    stats = get_stats_for_chat(TEST_CHAT_ID)
-    assert str(TEST_USER_ID) in stats
-    assert stats[str(TEST_USER_ID)] == 1
-    increment_stat(TEST_CHAT_ID, TEST_USER_ID)
-    stats = get_stats_for_chat(TEST_CHAT_ID)
-    assert stats[str(TEST_USER_ID)] == 2
-
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+
+import victim_bot
+from benchmark import run_benchmark
+from dayclock import DayClock
+from fake_telegram import FakeTelegram, UpdateFactory
+from phrases.templates import PhrasePoolCache, PhraseTemplateError
+from phrases.victim_phrases import VICTIM_PHRASES
+from sender import SendQueue
+from storage import JsonBackend
+
+# Импортируем функции из victim_bot.py (если структура пакета позволяет)
+from victim_bot import (
+    save_json, load_json, get_users, set_users, add_user,
+    get_custom_phrases, add_custom_phrase, del_custom_phrase,
+    increment_stat, get_stats_for_chat
+)
+
+TEST_CHAT_ID = 12345
+TEST_USER_ID = 999
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch, files):
+    # Каждый тест — с пустым хранилищем и свежими кэшами
+    monkeypatch.setattr(victim_bot, "backend", JsonBackend(files, today=victim_bot.today_bucket))
+    monkeypatch.setattr(victim_bot, "phrase_pools", PhrasePoolCache(VICTIM_PHRASES, get_custom_phrases))
+    monkeypatch.setattr(victim_bot, "sender", SendQueue())
+    victim_bot.mention_cache.clear()
+    yield
+
+def test_json_save_and_load(tmp_path):
+    data = {"a": 1}
+    path = str(tmp_path / "test_file.json")
+    save_json(path, data)
+    loaded = load_json(path)
+    assert loaded == data
+
+def test_users():
+    set_users(TEST_CHAT_ID, [])
+    assert get_users(TEST_CHAT_ID) == []
+    add_user(TEST_CHAT_ID, TEST_USER_ID)
+    assert get_users(TEST_CHAT_ID) == [TEST_USER_ID]
+
+def test_phrases():
+    assert get_custom_phrases(TEST_CHAT_ID) == []
+    add_custom_phrase(TEST_CHAT_ID, "Hello, {mention}!")
+    phrases = get_custom_phrases(TEST_CHAT_ID)
+    assert "Hello, {mention}!" in phrases
+    idx = phrases.index("Hello, {mention}!")
+    assert del_custom_phrase(TEST_CHAT_ID, idx) is True
+    assert "Hello, {mention}!" not in get_custom_phrases(TEST_CHAT_ID)
+
+def test_phrase_list_marks_unusable_phrases():
+    listing = victim_bot.build_phrase_list(["Без упоминания", "сломанная {"])
+    lines = listing.splitlines()
+    assert lines[1] == "0. Без упоминания" and "не используется" not in lines[2]
+    assert lines[2] == "1. сломанная {" and "не используется" in lines[3]
+    with pytest.raises(PhraseTemplateError):
+        add_custom_phrase(TEST_CHAT_ID, "Hello, {name}!")
+
+def test_statistics():
+    increment_stat(TEST_CHAT_ID, TEST_USER_ID)
+    stats = get_stats_for_chat(TEST_CHAT_ID)
+    assert str(TEST_USER_ID) in stats
+    assert stats[str(TEST_USER_ID)] == 1
+    increment_stat(TEST_CHAT_ID, TEST_USER_ID)
+    stats = get_stats_for_chat(TEST_CHAT_ID)
+    assert stats[str(TEST_USER_ID)] == 2
+
+def test_statistics_periods(monkeypatch):
+    backend = victim_bot.backend
+    backend.record_draw(TEST_CHAT_ID, 1, "manual", 0.0, "2024-12-31")
+    backend.record_draw(TEST_CHAT_ID, 1, "manual", 0.0, "2025-06-01")
+    backend.record_draw(TEST_CHAT_ID, 2, "manual", 0.0, "2025-06-18")
+    backend.record_draw(TEST_CHAT_ID, 2, "manual", 0.0, "2025-06-19")
+    backend.record_draw(TEST_CHAT_ID, 2, "autorun", 0.0, "2025-06-20")
+    noon = victim_bot.tz.localize(victim_bot.datetime(2025, 6, 20, 12)).timestamp()
+    monkeypatch.setattr(victim_bot, "day_clock", DayClock(victim_bot.tz, clock=lambda: noon))
+    assert get_stats_for_chat(TEST_CHAT_ID, "week") == {"2": 3}
+    assert get_stats_for_chat(TEST_CHAT_ID, "month") == {"1": 1, "2": 3}
+    assert get_stats_for_chat(TEST_CHAT_ID, "year") == {"1": 1, "2": 3}
+    assert get_stats_for_chat(TEST_CHAT_ID) == {"1": 2, "2": 3}
+    assert victim_bot.get_streaks(TEST_CHAT_ID) == {"1": 1, "2": 3}
+
+def test_victim_command_respects_daily_limit(monkeypatch):
+    session = FakeTelegram()
+    bot = Bot(token="42:TEST", session=session)
+    monkeypatch.setattr(victim_bot, "bot", bot)
+    factory = UpdateFactory()
+
+    async def scenario():
+        for user_id in (1, 2, 3):
+            update = factory.message(TEST_CHAT_ID, user_id, "привет")
+            await victim_bot.dp.feed_update(bot, types.Update.model_validate(update))
+        # Две одновременные команды: жеребьёвка должна пройти ровно одна
+        await asyncio.gather(*(
+            victim_bot.dp.feed_update(bot, types.Update.model_validate(factory.message(TEST_CHAT_ID, 1, "/victim")))
+            for _ in range(2)
+        ))
+        await victim_bot.sender.close()
+
+    asyncio.run(scenario())
+    assert sum(get_stats_for_chat(TEST_CHAT_ID).values()) == 1
+    assert victim_bot.get_settings(TEST_CHAT_ID)["runs_today"] == 1
+    texts = [text for _, text in session.sent]
+    assert len(texts) == 2
+    assert any("лимит" in text for text in texts)
+
+class NotModifiedTelegram(FakeTelegram):
+    # Страница уже показана: Telegram отказывает в правке
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, EditMessageText):
+            self.calls["EditMessageText"] += 1
+            raise TelegramBadRequest(method=method, message="Bad Request: message is not modified")
+        return await super().make_request(bot, method, timeout)
+
+def test_stats_page_callback_always_answered(monkeypatch):
+    session = NotModifiedTelegram()
+    bot = Bot(token="42:TEST", session=session)
+    monkeypatch.setattr(victim_bot, "bot", bot)
+    for user_id in range(1, 4):
+        increment_stat(TEST_CHAT_ID, user_id)
+    updates = UpdateFactory()
+    page = victim_bot.StatsPage(page=0, period="all").pack()
+
+    async def scenario():
+        for update in (
+            updates.callback(TEST_CHAT_ID, TEST_USER_ID, page),
+            updates.callback(TEST_CHAT_ID, TEST_USER_ID, victim_bot.StatsPage(page=0, period="bogus").pack()),
+            updates.callback(TEST_CHAT_ID, TEST_USER_ID, page, accessible=False),
+        ):
+            await victim_bot.dp.feed_update(bot, types.Update.model_validate(update))
+        await victim_bot.sender.close()
+
+    asyncio.run(scenario())
+    assert session.calls["EditMessageText"] == 1
+    assert session.calls["AnswerCallbackQuery"] == 3
+
+def test_foreign_shard_updates_are_dropped(monkeypatch):
+    bot = Bot(token="42:TEST", session=FakeTelegram())
+    monkeypatch.setattr(victim_bot.config, "SHARD_COUNT", 2)
+    monkeypatch.setattr(victim_bot.config, "SHARD_INDEX", 1 - victim_bot.shard_of(TEST_CHAT_ID, 2))
+    update = UpdateFactory().message(TEST_CHAT_ID, TEST_USER_ID, "привет")
+    asyncio.run(victim_bot.dp.feed_update(bot, types.Update.model_validate(update)))
+    assert get_users(TEST_CHAT_ID) == []
+
+def test_autorun_schedules_only_own_shard(monkeypatch):
+    # Общая база шардов: в настройках есть и чужие чаты
+    chats = [-100 - i for i in range(6)]
+    for chat_id in chats:
+        victim_bot.set_setting(chat_id, "last_run_date", "2025-06-20")
+    monkeypatch.setattr(victim_bot.config, "SHARD_COUNT", 2)
+    monkeypatch.setattr(victim_bot.config, "SHARD_INDEX", 0)
+    scheduler = victim_bot.DeadlineScheduler()
+
+    async def idle(callback):
+        pass
+
+    monkeypatch.setattr(scheduler, "run", idle)
+    monkeypatch.setattr(victim_bot, "scheduler", scheduler)
+    asyncio.run(victim_bot.autorun_scheduler())
+    own = [chat_id for chat_id in chats if victim_bot.shard_of(chat_id, 2) == 0]
+    assert own and len(own) < len(chats)
+    assert sorted(int(chat_id) for chat_id in scheduler.pop_due(float("inf"))) == sorted(own)
+
+def test_bot_commands_set_only_when_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(victim_bot.config, "COMMANDS_HASH_FILE", str(tmp_path / "commands_hash.json"))
+    session = FakeTelegram()
+    bot = Bot(token="42:TEST", session=session)
+    asyncio.run(victim_bot.set_bot_commands(bot))
+    asyncio.run(victim_bot.set_bot_commands(bot))
+    assert session.calls["SetMyCommands"] == 1
+    monkeypatch.setattr(victim_bot.config, "COMMANDS", victim_bot.config.COMMANDS[:1])
+    asyncio.run(victim_bot.set_bot_commands(bot))
+    assert session.calls["SetMyCommands"] == 2
+
+def test_import_needs_no_token_or_data_dir(tmp_path):
+    env = dict(os.environ, DATA_DIR=str(tmp_path / "missing"))
+    env.pop("BOT_TOKEN", None)
+    subprocess.run([sys.executable, "-c", "import victim_bot"], env=env, check=True, cwd=os.path.dirname(__file__))
+    assert not (tmp_path / "missing").exists()
+
+def test_overdue_autorun_spreads_over_jitter_window(monkeypatch):
+    monkeypatch.setattr(victim_bot, "scheduler", victim_bot.DeadlineScheduler())
+    before = victim_bot.time.time()
+    victim_bot.schedule_autorun(TEST_CHAT_ID, "2000-01-01")
+    due = victim_bot.scheduler.due_at(str(TEST_CHAT_ID))
+    offset = victim_bot.jitter_for(TEST_CHAT_ID, victim_bot.config.AUTORUN_JITTER_SECONDS)
+    assert before + offset <= due <= victim_bot.time.time() + offset
+
+def test_failed_autorun_stays_scheduled(monkeypatch):
+    # Каждый запрос получает 429, повторов нет — отправка падает
+    bot = Bot(token="42:TEST", session=FakeTelegram(flood_rate=1.0))
+    monkeypatch.setattr(victim_bot, "bot", bot)
+    monkeypatch.setattr(victim_bot, "sender", SendQueue(max_retries=0))
+    monkeypatch.setattr(victim_bot, "scheduler", victim_bot.DeadlineScheduler())
+    for user_id in (1, 2, 3):
+        add_user(TEST_CHAT_ID, user_id)
+
+    async def scenario():
+        try:
+            await victim_bot.autorun_chat_serialized(str(TEST_CHAT_ID))
+        finally:
+            await victim_bot.sender.close()
+
+    before = victim_bot.time.time()
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(scenario())
+    due = victim_bot.scheduler.due_at(str(TEST_CHAT_ID))
+    assert due >= before + victim_bot.config.AUTORUN_RETRY_SECONDS
+    assert victim_bot.get_settings(TEST_CHAT_ID).get("runs_today") is None
+
+def test_autorun_skipped_after_manual_draw(monkeypatch):
+    # /victim прошёл, пока автозапуск ждал блокировку чата
+    session = FakeTelegram()
+    monkeypatch.setattr(victim_bot, "bot", Bot(token="42:TEST", session=session))
+    monkeypatch.setattr(victim_bot.config, "DAILY_LIMIT_PER_CHAT", 2)
+    monkeypatch.setattr(victim_bot, "scheduler", victim_bot.DeadlineScheduler())
+    for user_id in (1, 2, 3):
+        add_user(TEST_CHAT_ID, user_id)
+    today = victim_bot.today_str()
+    victim_bot.set_setting(TEST_CHAT_ID, "last_run_date", today)
+    victim_bot.set_setting(TEST_CHAT_ID, "runs_today", 1)
+    asyncio.run(victim_bot.autorun_chat_serialized(str(TEST_CHAT_ID)))
+    assert session.sent == []
+    assert victim_bot.get_settings(TEST_CHAT_ID)["runs_today"] == 1
+    assert victim_bot.scheduler.due_at(str(TEST_CHAT_ID)) == victim_bot.autorun_due(TEST_CHAT_ID, today)
+
+def test_autorun_dropped_when_bot_was_kicked(monkeypatch):
+    monkeypatch.setattr(victim_bot, "scheduler", victim_bot.DeadlineScheduler())
+
+    async def kicked(chat_id):
+        raise TelegramForbiddenError(SendMessage(chat_id=chat_id, text="x"), "bot was kicked from the group chat")
+
+    monkeypatch.setattr(victim_bot, "draw_autorun", kicked)
+    asyncio.run(victim_bot.autorun_chat(str(TEST_CHAT_ID)))
+    assert victim_bot.scheduler.due_at(str(TEST_CHAT_ID)) is None
+
+def test_benchmark_smoke(monkeypatch):
+    # run_benchmark подменяет victim_bot.bot — monkeypatch вернёт прежний
+    monkeypatch.setattr(victim_bot, "bot", victim_bot.bot)
+    results = asyncio.run(run_benchmark(victim_bot, chats=2, users=3, messages=1, member_latency=0))
+    for scenario in ("mark_user_as_active", "victim", "statistics", "scheduler_tick"):
+        assert results[scenario]["count"] > 0
+        assert results[scenario]["p99_ms"] >= results[scenario]["p50_ms"]
+
+def test_botstats_and_metrics(monkeypatch):
+    session = FakeTelegram()
+    bot = Bot(token="42:TEST", session=session)
+    monkeypatch.setattr(victim_bot.config, "ADMIN_IDS", {7})
+    factory = UpdateFactory()
+
+    async def scenario():
+        for user_id in (5, 7):
+            update = factory.message(TEST_CHAT_ID, user_id, "/botstats")
+            await victim_bot.dp.feed_update(bot, types.Update.model_validate(update))
+        await victim_bot.sender.close()
+
+    asyncio.run(scenario())
+    assert "только администраторам" in session.sent[0][1]
+    assert "Статистика бота" in session.sent[1][1]
+    assert "Хранилище:" in session.sent[1][1] and "Файлы состояния:" in session.sent[1][1]
+    text = victim_bot.REGISTRY.render()
+    assert 'victim_handler_seconds_count{handler="/botstats"}' in text
+    assert "victim_scheduler_chats" in text
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, LatencyStats, build_app, read_updates, run_webhook
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10,
+        "date": 1750000000,
+        "chat": {"id": -100, "type": "supergroup", "title": "test"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Vasya"},
+        "text": "привет",
+    },
+}
+
+def test_webhook_feeds_dispatcher_and_checks_secret():
+    async def scenario():
+        dp = Dispatcher()
+        seen = asyncio.Event()
+        received = []
+
+        @dp.message()
+        async def on_message(message: types.Message):
+            received.append((message.chat.id, message.from_user.id))
+            seen.set()
+
+        stats = LatencyStats()
+        bot = Bot(token="42:TEST")
+        app = build_app(dp, bot, "/webhook", secret_token="s3cret", stats=stats)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.post("/webhook", json=UPDATE)
+            assert resp.status == 401
+            resp = await client.post("/webhook", json=UPDATE, headers={SECRET_HEADER: "s3cret"})
+            assert resp.status == 200
+            await asyncio.wait_for(seen.wait(), 1)
+        await bot.session.close()
+        return received, stats.stats()
+
+    received, stats = asyncio.run(scenario())
+    assert received == [(-100, 42)]
+    assert stats["count"] == 2
+
+def test_read_updates_accepts_array_and_lines(tmp_path):
+    array = tmp_path / "updates.json"
+    array.write_text(json.dumps([UPDATE, UPDATE]), encoding="utf-8")
+    lines = tmp_path / "updates.ndjson"
+    lines.write_text(json.dumps(UPDATE) + "\n" + json.dumps(UPDATE) + "\n", encoding="utf-8")
+    assert read_updates(str(array)) == read_updates(str(lines)) == [UPDATE, UPDATE]
+
+def test_run_webhook_returns_on_sigterm():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def scenario():
+        bot = Bot(token="42:TEST")
+        server = asyncio.create_task(run_webhook(Dispatcher(), bot, "", "/webhook", "127.0.0.1", port))
+        await asyncio.sleep(0.3)
+        os.kill(os.getpid(), signal.SIGTERM)
+        # Сервер завершается сам, и finally вызывающего кода успевает отработать
+        await asyncio.wait_for(server, 5)
+        await bot.session.close()
+
+    asyncio.run(scenario())
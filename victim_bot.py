@@ -1,100 +1,177 @@
+import asyncio
+import hashlib
+import html
 import logging
 import os
 import json
 import random
-import pytz
+import socket
+import sys
+import time
 from datetime import datetime, timedelta
 
 import pytz
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command, CommandObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ChatType
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from dotenv import load_dotenv
 
+import backup
 import config
+from chat_executor import ChatExecutor
+from dayclock import DayClock
+from scheduler import DeadlineScheduler, jitter_for
+from sharding import ShardLease, hold_data_dir, shard_of
+from sender import PRIORITY_AUTORUN, SendQueue
+from metrics import (
+    API_ERRORS, API_SECONDS, DRAWS, HANDLER_SECONDS, REGISTRY, STORAGE_CALL_SECONDS, STORAGE_SECONDS,
+    api_metrics_middleware, start_metrics_server,
+)
+from mentions import MentionCache, format_mention, resolve_mentions
+from storage import FileLock, create_backend, load_json, save_json
+from storage.buckets import longest_streaks, merge_buckets
+from storage.participants import active_since
+from webhook import LatencyStats, run_webhook
 
-os.makedirs(config.DATA_DIR, exist_ok=True)
-
+from phrases.templates import PhrasePoolCache, PhraseTemplateError, compile_phrase, phrase_error, render_phrase
 from phrases.victim_phrases import VICTIM_PHRASES
 
 # ================== ИНИЦИАЛИЗАЦИЯ ====================
+# При импорте ничего не читаем с диска и не требуем токена: бот, папка
+# данных и состояние появляются при первом обращении или в main()
 load_dotenv()
-API_TOKEN = os.getenv("BOT_TOKEN")
-if not API_TOKEN:
-    raise Exception("Укажите токен бота в .env (BOT_TOKEN=...)")
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s %(message)s",
 )
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+bot = None
 dp = Dispatcher()
 
-# =============== JSON-УТИЛИТЫ ==================
-def load_json(file, default=None):
-    if default is None:
-        default = {}
-    try:
-        if not os.path.exists(file):
-            return default
-        with open(file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Ошибка чтения {file}: {e}")
-        return default
-
-def save_json(file, data):
-    try:
-        with open(file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logging.error(f"Ошибка записи {file}: {e}")
+def get_bot():
+    global bot
+    if bot is None:
+        token = os.getenv("BOT_TOKEN")
+        if not token:
+            raise Exception("Укажите токен бота в .env (BOT_TOKEN=...)")
+        bot = Bot(token=token, default=DefaultBotProperties(parse_mode="HTML"))
+        bot.session.middleware(api_metrics_middleware)
+    return bot
 
 # =============== ВРЕМЯ ========================
+tz = pytz.timezone(config.TIMEZONE)
+day_clock = DayClock(tz)
+
 def now_in_tz():
-    tz = pytz.timezone(config.TIMEZONE)
     return datetime.now(tz)
 
 def today_str():
-    return now_in_tz().strftime("%Y-%m-%d")
+    return day_clock.today()
 
 def is_new_day(old_date):
     return old_date != today_str()
 
+def today_bucket():
+    return day_clock.bucket()
+
+# =============== ХРАНИЛИЩЕ ==================
+# Реализация выбирается в config.STORAGE_BACKEND (см. пакет storage);
+# «сегодня» для участников — в часовом поясе бота, как и всё остальное
+backend = create_backend(config, today=today_bucket)
+
+# Апдейты одного чата и автозапуск в нём обрабатываются по очереди,
+# разные чаты — параллельно
+chat_executor = ChatExecutor()
+
+def owns_chat(chat_id):
+    # Относится ли чат к шарду этого процесса
+    return shard_of(chat_id, config.SHARD_COUNT) == config.SHARD_INDEX
+
+@dp.update.outer_middleware()
+async def drop_foreign_chats(handler, update: types.Update, data):
+    # При шардировании чужие чаты не обрабатываем: их состояние живёт в
+    # другом процессе (апдейт мог прийти мимо маршрутизатора)
+    chat = data.get("event_chat")
+    if chat is not None and not owns_chat(chat.id):
+        logging.debug(f"Чат {chat.id} относится к другому шарду, апдейт пропущен")
+        return None
+    return await handler(update, data)
+
+@dp.update.outer_middleware()
+async def serialize_per_chat(handler, update: types.Update, data):
+    chat = data.get("event_chat")
+    if chat is None:
+        return await handler(update, data)
+    async with chat_executor.lock(chat.id):
+        return await handler(update, data)
+
+# Упоминания участников: кэш наполняется из каждого входящего сообщения,
+# так что к get_chat_member приходится обращаться редко
+mention_cache = MentionCache(config.MENTION_CACHE_SIZE, config.MENTION_CACHE_TTL)
+
 # =============== СТАТИСТИКА ===================
-def increment_stat(chat_id, user_id):
-    stats = load_json(config.STATS_FILE)
-    chat_id = str(chat_id)
-    user_id = str(user_id)
-    if chat_id not in stats:
-        stats[chat_id] = {}
-    if user_id not in stats[chat_id]:
-        stats[chat_id][user_id] = 0
-    stats[chat_id][user_id] += 1
-    save_json(config.STATS_FILE, stats)
+# Каждая жеребьёвка пишется в историю и в корзины по дням и месяцам;
+# статистика за период собирается из корзин, а не из всей истории.
+STATS_PERIODS = {
+    "week": "week", "неделя": "week",
+    "month": "month", "месяц": "month",
+    "year": "year", "год": "year",
+    "all": "all", "всё": "all", "все": "all",
+    "streak": "streak", "серии": "streak",
+}
+STATS_TITLES = {
+    "week": "Жертвы дня за последние 7 дней",
+    "month": "Жертвы дня за этот месяц",
+    "year": "Жертвы дня за этот год",
+    "all": "Статистика жертв дня",
+    "streak": "Самые длинные серии (дней подряд)",
+}
+
+def increment_stat(chat_id, user_id, kind="manual"):
+    backend.record_draw(chat_id, user_id, kind, time.time(), day_clock.today())
     logging.info(f"Статистика: +1 попадание {user_id} в чате {chat_id}")
 
-def get_stats_for_chat(chat_id):
-    stats = load_json(config.STATS_FILE)
-    return stats.get(str(chat_id), {})
+def get_stats_for_chat(chat_id, period="all"):
+    if period == "all":
+        return backend.get_stats_for_chat(chat_id)
+    today = day_clock.date()
+    if period == "week":
+        first = (today - timedelta(days=6)).isoformat()
+        buckets = backend.get_buckets(chat_id, "d", first, today.isoformat())
+    elif period == "month":
+        month = today.strftime("%Y-%m")
+        buckets = backend.get_buckets(chat_id, "m", month, month)
+    elif period == "year":
+        buckets = backend.get_buckets(chat_id, "m", f"{today.year}-01", f"{today.year}-12")
+    else:
+        raise ValueError(f"Неизвестный период статистики: {period}")
+    return merge_buckets(buckets.values())
+
+def get_streaks(chat_id):
+    return longest_streaks(backend.get_buckets(chat_id, "d", "0000", "9999"))
 
 # =============== УЧАСТНИКИ И ПРОЯВЛЕНИЕ ================
 def get_users(chat_id):
-    data = load_json(config.USERS_FILE)
-    return data.get(str(chat_id), [])
+    return backend.get_users(chat_id)
+
+def get_active_users(chat_id):
+    # Кандидаты в жертвы: проявлялись за последние ACTIVE_WINDOW_DAYS дней
+    if config.ACTIVE_WINDOW_DAYS <= 0:
+        return get_users(chat_id)
+    since = today_bucket() - config.ACTIVE_WINDOW_DAYS
+    return active_since(backend.get_participants(chat_id), since)
 
 def set_users(chat_id, users):
-    data = load_json(config.USERS_FILE)
-    data[str(chat_id)] = users
-    save_json(config.USERS_FILE, data)
+    backend.set_users(chat_id, users, today_bucket())
     logging.info(f"Проявленные пользователи чата {chat_id}: {users}")
 
 def add_user(chat_id, user_id):
-    users = get_users(chat_id)
-    if user_id not in users:
-        users.append(user_id)
-        set_users(chat_id, users)
+    if backend.touch_user(chat_id, user_id, today_bucket()):
+        logging.info(f"Новый проявленный пользователь {user_id} в чате {chat_id}")
 
 @dp.message(lambda msg: msg.chat.type in [ChatType.SUPERGROUP, ChatType.GROUP] and not (msg.text and msg.text.startswith('/')))
 async def mark_user_as_active(message: types.Message):
@@ -102,42 +179,47 @@ async def mark_user_as_active(message: types.Message):
 
 # --------------------- КАСТОМНЫЕ ФРАЗЫ ---------------------
 def get_custom_phrases(chat_id):
-    data = load_json(config.CUSTOM_PHRASES_FILE, default={})
-    return data.get(str(chat_id), [])
+    return backend.get_custom_phrases(chat_id)
 
 def add_custom_phrase(chat_id, phrase):
-    data = load_json(config.CUSTOM_PHRASES_FILE, default={})
-    arr = data.get(str(chat_id), [])
-    arr.append(phrase)
-    data[str(chat_id)] = arr
-    save_json(config.CUSTOM_PHRASES_FILE, data)
+    # Шаблон проверяется сразу, а не в момент жеребьёвки
+    compile_phrase(phrase)
+    backend.add_custom_phrase(chat_id, phrase)
+    phrase_pools.invalidate(chat_id)
     logging.info(f"Добавлена фраза: {phrase} в чате {chat_id}")
 
 def del_custom_phrase(chat_id, idx):
-    data = load_json(config.CUSTOM_PHRASES_FILE, default={})
-    arr = data.get(str(chat_id), [])
-    if 0 <= idx < len(arr):
-        removed = arr.pop(idx)
-        data[str(chat_id)] = arr
-        save_json(config.CUSTOM_PHRASES_FILE, data)
+    removed = backend.del_custom_phrase(chat_id, idx)
+    if removed is not None:
+        phrase_pools.invalidate(chat_id)
         logging.info(f"Удалена фраза: {removed} из чата {chat_id}")
         return True
     return False
 
-def get_all_phrases(chat_id):
-    return VICTIM_PHRASES + get_custom_phrases(chat_id)
+# Встроенные фразы + скомпилированные фразы чата, кэш по чатам
+phrase_pools = PhrasePoolCache(VICTIM_PHRASES, get_custom_phrases)
+
+def draw_phrase(chat_id, mention):
+    return render_phrase(phrase_pools.choose(chat_id), mention)
+
+def build_phrase_list(phrases):
+    if not phrases:
+        return "Пользовательские фразы отсутствуют."
+    txt = "<b>Пользовательские фразы:</b>\n"
+    for i, s in enumerate(phrases):
+        txt += f"{i}. {html.escape(s, quote=False)}\n"
+        error = phrase_error(s)
+        if error:
+            # Сохранена до появления проверки шаблонов и в жеребьёвке не участвует
+            txt += f"   <i>не используется: {html.escape(error, quote=False)}</i>\n"
+    return txt
 
 # =============== НАСТРОЙКИ ============================
 def get_settings(chat_id):
-    data = load_json(config.SETTINGS_FILE)
-    return data.get(str(chat_id), {})
+    return backend.get_settings(chat_id)
 
 def set_setting(chat_id, key, value):
-    data = load_json(config.SETTINGS_FILE)
-    chat_settings = data.get(str(chat_id), {})
-    chat_settings[key] = value
-    data[str(chat_id)] = chat_settings
-    save_json(config.SETTINGS_FILE, data)
+    backend.set_setting(chat_id, key, value)
 
 def get_setting(chat_id, key, default=None):
     settings = get_settings(chat_id)
@@ -152,35 +234,80 @@ async def extract_user_id(message: types.Message):
         return message.reply_to_message.from_user.id
     return None
 
+async def fetch_user_mention(chat_id, user_id):
+    member = await get_bot().get_chat_member(chat_id, user_id)
+    mention = format_mention(member.user)
+    mention_cache.put(chat_id, user_id, mention)
+    return mention
+
 async def get_user_mention(chat_id, user_id):
+    mention = mention_cache.get(chat_id, user_id)
+    if mention is not None:
+        return mention
     try:
-        member = await bot.get_chat_member(chat_id, user_id)
-        user = member.user
-        if user.username:
-            return f"@{user.username}"
-        elif user.full_name:
-            return user.full_name
-        else:
-            return f"User {user_id}"
+        return await fetch_user_mention(chat_id, user_id)
     except Exception:
         return f"User {user_id}"
 
+async def get_user_mentions(chat_id, user_ids):
+    # Упоминания для списка пользователей: из кэша, недостающие — параллельно
+    mentions = {user_id: mention_cache.get(chat_id, user_id) for user_id in user_ids}
+    missing = [user_id for user_id, mention in mentions.items() if mention is None]
+    if missing:
+        resolved = await resolve_mentions(
+            lambda user_id: fetch_user_mention(chat_id, user_id),
+            missing,
+            concurrency=config.MENTION_CONCURRENCY,
+            timeout=config.MENTION_TIMEOUT,
+        )
+        mentions.update(zip(missing, resolved))
+    return [mentions[user_id] for user_id in user_ids]
+
+@dp.message.outer_middleware()
+async def remember_mention(handler, message: types.Message, data):
+    # Автор сообщения уже известен — запоминаем его упоминание бесплатно
+    if message.from_user and not message.from_user.is_bot:
+        mention_cache.put(message.chat.id, message.from_user.id, format_mention(message.from_user))
+    return await handler(message, data)
+
+@dp.chat_member()
+async def member_updated(event: types.ChatMemberUpdated):
+    # Сменил имя, вышел или вернулся — старое упоминание больше не годится
+    mention_cache.invalidate(event.chat.id, event.new_chat_member.user.id)
+
+# ============= ОТПРАВКА СООБЩЕНИЙ ========================
+# Все ответы идут через общую очередь с лимитами Telegram (см. sender.py).
+# Состояние после отправки меняем только если отправка удалась:
+# sender.send пробрасывает ошибку вызывающему.
+sender = SendQueue(
+    global_rate=config.SEND_GLOBAL_PER_SECOND,
+    chat_per_minute=config.SEND_CHAT_PER_MINUTE,
+    workers=config.SEND_WORKERS,
+)
+
+async def reply(message: types.Message, text, **kwargs):
+    return await sender.send(message.chat.id, lambda: message.reply(text, **kwargs))
+
 # ============= ОБРАБОТЧИКИ КОМАНД ========================
 @dp.message(Command("start"))
 async def start_cmd(message: types.Message):
-    await message.reply(config.WELCOME_GROUP_MESSAGE.format(limit=get_limit_for_chat(message.chat.id)))
+    await reply(message, config.WELCOME_GROUP_MESSAGE.format(limit=get_limit_for_chat(message.chat.id)))
 
 @dp.message(Command("help"))
 async def help_cmd(message: types.Message):
-    await message.reply(config.HELP_MESSAGE, parse_mode="HTML")
+    await reply(message, config.HELP_MESSAGE, parse_mode="HTML")
 
 @dp.message(Command("add_phrase"))
 async def add_phrase_cmd(message: types.Message, command: CommandObject):
     if not command.args:
-        await message.reply("Используй: /add_phrase текст фразы")
+        await reply(message, "Используй: /add_phrase текст фразы")
         return
-    add_custom_phrase(message.chat.id, command.args.strip())
-    await message.reply("Фраза добавлена!")
+    try:
+        add_custom_phrase(message.chat.id, command.args.strip())
+    except PhraseTemplateError as e:
+        await reply(message, f"Фраза не добавлена: {html.escape(str(e), quote=False)}")
+        return
+    await reply(message, "Фраза добавлена!")
 
 @dp.message(Command("del_phrase"))
 async def del_phrase_cmd(message: types.Message, command: CommandObject):
@@ -188,43 +315,96 @@ async def del_phrase_cmd(message: types.Message, command: CommandObject):
         idx = int(command.args.strip())
         ok = del_custom_phrase(message.chat.id, idx)
         if ok:
-            await message.reply("Фраза удалена.")
+            await reply(message, "Фраза удалена.")
         else:
-            await message.reply("Нет такой фразы.")
+            await reply(message, "Нет такой фразы.")
     except Exception:
-        await message.reply("Укажи номер фразы: /del_phrase номер")
+        await reply(message, "Укажи номер фразы: /del_phrase номер")
 
 @dp.message(Command("list_phrases"))
 async def list_phrases_cmd(message: types.Message):
-    phrases = get_custom_phrases(message.chat.id)
-    if not phrases:
-        await message.reply("Пользовательские фразы отсутствуют.")
-        return
-    txt = "<b>Пользовательские фразы:</b>\n"
-    for i, s in enumerate(phrases):
-        txt += f"{i}. {s}\n"
-    await message.reply(txt, parse_mode="HTML")
+    txt = phrase_pools.listing(message.chat.id, build_phrase_list)
+    await reply(message, txt, parse_mode="HTML")
 
-@dp.message(Command("statistics"))
-async def statistics_cmd(message: types.Message):
-    stats = get_stats_for_chat(message.chat.id)
+class StatsPage(CallbackData, prefix="stats"):
+    page: int
+    period: str = "all"
+
+async def render_stats_page(chat_id, page, period="all"):
+    # Упоминания запрашиваются только для строк показываемой страницы
+    stats = get_streaks(chat_id) if period == "streak" else get_stats_for_chat(chat_id, period)
     if not stats:
-        await message.reply("Пока никто не был жертвой дня в этом чате.")
+        return None, None
+    ranking = sorted(stats.items(), key=lambda x: -x[1])
+    size = config.STATS_PAGE_SIZE
+    pages = (len(ranking) + size - 1) // size
+    page = max(0, min(page, pages - 1))
+    chunk = ranking[page * size:(page + 1) * size]
+    mentions = await get_user_mentions(chat_id, [int(user_id) for user_id, _ in chunk])
+    table = "\n".join(
+        f"{page * size + i + 1}. {mention} — <b>{count}</b>"
+        for i, (mention, (_, count)) in enumerate(zip(mentions, chunk))
+    )
+    header = f"<b>{STATS_TITLES[period]}:</b>"
+    if pages > 1:
+        header += f" (стр. {page + 1}/{pages})"
+    keyboard = InlineKeyboardBuilder()
+    if page > 0:
+        keyboard.button(text="◀️ Назад", callback_data=StatsPage(page=page - 1, period=period))
+    if page < pages - 1:
+        keyboard.button(text="Дальше ▶️", callback_data=StatsPage(page=page + 1, period=period))
+    markup = keyboard.as_markup() if pages > 1 else None
+    return f"{header}\n\n{table}", markup
+
+@dp.message(Command("statistics"))
+async def statistics_cmd(message: types.Message, command: CommandObject):
+    period = STATS_PERIODS.get((command.args or "all").strip().lower())
+    if period is None:
+        await reply(message, "Используй: /statistics [week|month|year|all|streak]")
+        return
+    text, markup = await render_stats_page(message.chat.id, 0, period)
+    if text is None:
+        if period == "all":
+            await reply(message, "Пока никто не был жертвой дня в этом чате.")
+        else:
+            await reply(message, "За этот период жертв дня не было.")
         return
-    rows = []
-    for user_id, count in sorted(stats.items(), key=lambda x: -x[1]):
-        mention = await get_user_mention(message.chat.id, int(user_id))
-        rows.append(f"{mention} — <b>{count}</b>")
-    table = "\n".join(f"{i+1}. {row}" for i, row in enumerate(rows))
-    await message.reply(f"<b>Статистика жертв дня:</b>\n\n{table}", parse_mode="HTML")
+    await reply(message, text, parse_mode="HTML", reply_markup=markup)
+
+# Ошибки правки, при которых показывать нечего: двойное нажатие (страница
+# уже на экране) или сообщение удалено / слишком старое
+STATS_EDIT_IGNORED = ("message is not modified", "message to edit not found", "message can't be edited")
+
+@dp.callback_query(StatsPage.filter())
+async def statistics_page_cb(callback: types.CallbackQuery, callback_data: StatsPage):
+    # answer() вызывается всегда: без него кнопка у нажавшего «крутится»
+    try:
+        message = callback.message
+        # Неизвестный период — подделанные данные кнопки; InaccessibleMessage —
+        # сообщение старше 48 часов, его уже нельзя править
+        if callback_data.period not in STATS_TITLES or not isinstance(message, types.Message):
+            return
+        text, markup = await render_stats_page(message.chat.id, callback_data.page, callback_data.period)
+        if text is None:
+            return
+        try:
+            await sender.send(
+                message.chat.id,
+                lambda: message.edit_text(text, parse_mode="HTML", reply_markup=markup),
+            )
+        except TelegramBadRequest as e:
+            if not any(reason in str(e).lower() for reason in STATS_EDIT_IGNORED):
+                raise
+    finally:
+        await callback.answer()
 
 # ============== КОМАНДА /victim ====================
 @dp.message(Command("victim"))
 async def victim_cmd(message: types.Message):
-    # Получить список проявленных пользователей
-    users = get_users(message.chat.id)
+    # Получить список недавно проявлявшихся пользователей
+    users = get_active_users(message.chat.id)
     if len(users) < config.MIN_MEMBERS_TO_PICK:
-        await message.reply(f"Недостаточно участников для жеребьёвки (нужно хотя бы {config.MIN_MEMBERS_TO_PICK}).")
+        await reply(message, f"Недостаточно участников для жеребьёвки (нужно хотя бы {config.MIN_MEMBERS_TO_PICK}).")
         return
 
     # Проверка лимита по дням
@@ -236,7 +416,7 @@ async def victim_cmd(message: types.Message):
     if last_run_date != today:
         runs_today = 0
     if runs_today >= limit:
-        await message.reply(f"Сегодня лимит жеребьёвок исчерпан! ({limit}) Попробуйте снова завтра.")
+        await reply(message, f"Сегодня лимит жеребьёвок исчерпан! ({limit}) Попробуйте снова завтра.")
         return
 
     # Выбираем жертву
@@ -245,80 +425,298 @@ async def victim_cmd(message: types.Message):
     is_self = victim_id == message.from_user.id
 
     # Сообщение жеребьёвки (с "самоистязанием" если self)
-    phrases = get_all_phrases(message.chat.id)
-    phrase = random.choice(phrases) if phrases else "{mention} — жертва дня!"
+    phrase = draw_phrase(message.chat.id, mention)
     if is_self:
-        msg = f"Кажется сегодня кто-то займется самоистязанием!\n\n" + phrase.format(mention=mention)
+        msg = f"Кажется сегодня кто-то займется самоистязанием!\n\n" + phrase
     else:
-        msg = phrase.format(mention=mention)
-    await message.reply(msg, parse_mode="HTML")
+        msg = phrase
+    await reply(message, msg, parse_mode="HTML")
 
     # Сохраняем дату и счётчик запусков
     set_setting(message.chat.id, "last_run_date", today)
     set_setting(message.chat.id, "runs_today", runs_today + 1)
     increment_stat(message.chat.id, victim_id)
+    DRAWS.inc(kind="manual")
+    schedule_autorun(message.chat.id, today)
 
 # ========== АВТО-ЗАПУСК ПО ПРОСТОЮ ==================
-import asyncio
+scheduler = DeadlineScheduler(
+    workers=config.AUTORUN_WORKERS,
+    per_tick=config.AUTORUN_PER_TICK,
+    tick_interval=config.AUTORUN_TICK_SECONDS,
+    retry_after=config.AUTORUN_RETRY_SECONDS,
+)
+
+# Автозапуск в шарде ведёт только владелец аренды: если процессов шарда
+# несколько (перезапуск с перекрытием, резервный процесс), объявление
+# в чате не уйдёт дважды
+scheduler_lease = ShardLease(
+    os.path.join(config.DATA_DIR, "scheduler.lease"),
+    owner=f"{socket.gethostname()}:{os.getpid()}",
+    ttl=config.LEASE_SECONDS,
+)
+
+def autorun_due(chat_id, last_run_date):
+    # Срок автозапуска: полночь дня последней жеребьёвки + AUTORUN_IDLE_HOURS
+    if not last_run_date:
+        return time.time()
+    try:
+        last_dt = tz.localize(datetime.strptime(last_run_date, "%Y-%m-%d"))
+    except Exception as e:
+        logging.error(f"Ошибка сравнения времени для чата {chat_id}: {e}")
+        return None
+    return last_dt.timestamp() + config.AUTORUN_IDLE_HOURS * 3600
+
+def schedule_autorun(chat_id, last_run_date):
+    due = autorun_due(chat_id, last_run_date)
+    if due is None:
+        scheduler.cancel(str(chat_id))
+        return
+    now = time.time()
+    if due <= now:
+        # Просроченные чаты (простой бота, первый запуск) разносим по окну
+        due = now + jitter_for(chat_id, config.AUTORUN_JITTER_SECONDS)
+    scheduler.schedule(str(chat_id), due)
+
+def is_permanent_chat_error(error):
+    # Бота выгнали из чата или чата больше нет — повторять бесполезно
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()
+
+async def autorun_chat(chat_id):
+    # pop_due снимает чат с плана до начала попытки, поэтому после ошибки
+    # его нужно вернуть, иначе автозапуск в чате встанет до /victim
+    try:
+        await draw_autorun(chat_id)
+    except Exception as e:
+        if is_permanent_chat_error(e):
+            logging.warning(f"Автозапуск в чате {chat_id} отключён: {e}")
+            return
+        scheduler.schedule(str(chat_id), time.time() + config.AUTORUN_RETRY_SECONDS)
+        raise
+
+async def draw_autorun(chat_id):
+    settings = get_settings(chat_id)
+    last_run_date = settings.get("last_run_date", "")
+    # Чат снят с плана ещё до очереди за блокировкой чата; если за это время
+    # прошёл /victim, срок сдвинулся — не разыгрываем, а планируем заново
+    due = autorun_due(chat_id, last_run_date)
+    if due is None or due > time.time():
+        schedule_autorun(chat_id, last_run_date)
+        return
+    runs_today = settings.get("runs_today", 0)
+    limit = get_limit_for_chat(chat_id)
+    users = get_active_users(chat_id)
+    if len(users) < config.MIN_MEMBERS_TO_PICK:
+        scheduler.schedule(str(chat_id), time.time() + config.AUTORUN_RETRY_SECONDS)
+        return
+
+    if last_run_date != today_str():
+        runs_today = 0
+    if runs_today < limit:
+        victim_id = random.choice(users)
+        mention = await get_user_mention(chat_id, victim_id)
+        msg = f"{config.AUTO_RUN_MESSAGE}\n\n{draw_phrase(chat_id, mention)}"
+        await sender.send(
+            chat_id,
+            lambda: get_bot().send_message(chat_id, msg, parse_mode="HTML"),
+            priority=PRIORITY_AUTORUN,
+        )
+        last_run_date = today_str()
+        set_setting(chat_id, "last_run_date", last_run_date)
+        set_setting(chat_id, "runs_today", runs_today + 1)
+        increment_stat(chat_id, victim_id, kind="autorun")
+        DRAWS.inc(kind="autorun")
+    schedule_autorun(chat_id, last_run_date)
+
+async def autorun_chat_serialized(chat_id):
+    await chat_executor.run(chat_id, autorun_chat, chat_id)
 
 async def autorun_scheduler():
-    while True:
-        all_settings = load_json(config.SETTINGS_FILE)
-        tz = pytz.timezone(config.TIMEZONE)
-        now = now_in_tz()
-        for chat_id, settings in all_settings.items():
-            last_run_date = settings.get("last_run_date", "")
-            runs_today = settings.get("runs_today", 0)
-            limit = get_limit_for_chat(chat_id)
-            users = get_users(chat_id)
-            if len(users) < config.MIN_MEMBERS_TO_PICK:
-                continue
-
-            should_run = False
-            if not last_run_date:
-                should_run = True
-            else:
-                try:
-                    # ОТКОРРЕКТИРОВАНО! — датируем с tzinfo (локализуем к текущему tz)
-                    last_dt = datetime.strptime(last_run_date, "%Y-%m-%d").replace(tzinfo=now.tzinfo)
-                    delta = (now - last_dt).total_seconds()
-                    should_run = delta >= 259200
-                except Exception as e:
-                    logging.error(f"Ошибка сравнения времени для чата {chat_id}: {e}")
-                    should_run = False
-
-            if should_run:
-                if last_run_date != today_str():
-                    runs_today = 0
-                if runs_today < limit:
-                    victim_id = random.choice(users)
-                    mention = await get_user_mention(chat_id, victim_id)
-                    phrases = get_all_phrases(chat_id)
-                    phrase = random.choice(phrases) if phrases else "{mention} — жертва дня!"
-                    msg = f"{config.AUTO_RUN_MESSAGE}\n\n{phrase.format(mention=mention)}"
-                    await bot.send_message(chat_id, msg, parse_mode="HTML")
-                    set_setting(chat_id, "last_run_date", today_str())
-                    set_setting(chat_id, "runs_today", runs_today + 1)
-                    increment_stat(chat_id, victim_id)
-        await asyncio.sleep(3600)  # Проверять каждые 60 минут
+    # Один проход по настройкам при старте, дальше сроки обновляются
+    # при каждой жеребьёвке и планировщик спит до ближайшего из них
+    # Хранилище может быть общим для шардов (SQLITE_FILE задан явно) —
+    # планируем только свои чаты, иначе шарды объявляли бы жертву друг за друга
+    for chat_id, settings in backend.iter_settings():
+        if owns_chat(chat_id):
+            schedule_autorun(chat_id, settings.get("last_run_date", ""))
+    logging.info(f"Автозапуск: запланировано чатов — {len(scheduler)}")
+    await scheduler.run(autorun_chat_serialized)
 
 
 # ========== УСТАНОВКА КОМАНД БОТА ===================
+# Меню команд меняется редко, а перезапуски частые: хэш последнего
+# установленного набора хранится в COMMANDS_HASH_FILE, и если он совпал,
+# запрос к Telegram не делается
+def commands_hash(bot: Bot):
+    payload = json.dumps([bot.id, config.COMMANDS], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 async def set_bot_commands(bot: Bot):
-    await bot.set_my_commands([
-        types.BotCommand(command=cmd["command"], description=cmd["description"])
-        for cmd in config.COMMANDS
-    ])
+    digest = commands_hash(bot)
+    if load_json(config.COMMANDS_HASH_FILE).get("hash") == digest:
+        logging.info("Команды бота не менялись, установка пропущена")
+        return
+    try:
+        await bot.set_my_commands([
+            types.BotCommand(command=cmd["command"], description=cmd["description"])
+            for cmd in config.COMMANDS
+        ])
+    except Exception as e:
+        # Без меню команд бот работает; не мешаем запуску (и локальной проверке webhook)
+        logging.error(f"Не удалось установить команды бота: {e}")
+        return
+    save_json(config.COMMANDS_HASH_FILE, {"hash": digest})
     logging.info("Команды бота установлены")
 
+# ========== ЗАДЕРЖКИ ===================
+# Сколько проходит от отправки сообщения в чат до начала его обработки —
+# позволяет сравнить polling и webhook. В режиме webhook отдельно
+# считается время ответа на HTTP-запрос Telegram.
+delivery_lag = LatencyStats()
+webhook_latency = LatencyStats()
+
+@dp.update.outer_middleware()
+async def measure_delivery_lag(handler, update: types.Update, data):
+    if update.message is not None:
+        delivery_lag.record(max(0.0, time.time() - update.message.date.timestamp()))
+    return await handler(update, data)
+
+async def report_latency():
+    while True:
+        await asyncio.sleep(config.LATENCY_REPORT_SECONDS)
+        logging.info(f"Задержка доставки апдейтов ({config.RUN_MODE}): {delivery_lag.stats()}")
+        if config.RUN_MODE == "webhook":
+            logging.info(f"Время ответа webhook: {webhook_latency.stats()}")
+
+# ========== МЕТРИКИ ===================
+def handler_label(event, data):
+    command = data.get("command")
+    if command is not None:
+        return f"/{command.command}"
+    if isinstance(event, types.CallbackQuery):
+        return "callback"
+    return "message"
+
+async def time_handler(handler, event, data):
+    # Внутренний middleware: срабатывает, только когда нашёлся обработчик
+    with HANDLER_SECONDS.time(handler=handler_label(event, data)):
+        return await handler(event, data)
+
+dp.message.middleware(time_handler)
+dp.callback_query.middleware(time_handler)
+
+REGISTRY.gauge("victim_uptime_seconds", "Время работы процесса", lambda: round(time.time() - REGISTRY.started))
+REGISTRY.gauge("victim_scheduler_ticks", "Такты планировщика автозапуска", lambda: scheduler.ticks)
+REGISTRY.gauge("victim_scheduler_chats", "Чатов в плане автозапуска", lambda: len(scheduler))
+REGISTRY.gauge("victim_mention_cache", "Кэш упоминаний", lambda: mention_cache.stats(), label="stat")
+REGISTRY.gauge("victim_send_queue", "Очередь отправки", lambda: sender.stats(), label="stat")
+REGISTRY.gauge("victim_delivery_lag_ms", "Задержка доставки апдейтов", lambda: delivery_lag.stats(), label="stat")
+REGISTRY.gauge("victim_webhook_latency_ms", "Время ответа webhook", lambda: webhook_latency.stats(), label="stat")
+REGISTRY.gauge("victim_chat_locks", "Чатов с обработкой в процессе", lambda: len(chat_executor))
+
+def average_ms(summary):
+    count, total = summary.totals()
+    return count, (total / count * 1000 if count else 0.0)
+
+def build_botstats():
+    handlers_count, handlers_ms = average_ms(HANDLER_SECONDS)
+    storage_count, storage_ms = average_ms(STORAGE_CALL_SECONDS)
+    files_count, files_ms = average_ms(STORAGE_SECONDS)
+    api_count, api_ms = average_ms(API_SECONDS)
+    cache = mention_cache.stats()
+    queue = sender.stats()
+    uptime = int(time.time() - REGISTRY.started)
+    return (
+        "<b>Статистика бота</b>\n\n"
+        f"Работает: {uptime // 3600} ч {uptime % 3600 // 60} мин\n"
+        f"Обработчики: {handlers_count}, в среднем {handlers_ms:.1f} мс\n"
+        f"Хранилище: {storage_count} вызовов, в среднем {storage_ms:.2f} мс\n"
+        f"Файлы состояния: {files_count} операций, в среднем {files_ms:.2f} мс\n"
+        f"Bot API: {api_count} запросов, в среднем {api_ms:.0f} мс, ошибок {API_ERRORS.total()}\n"
+        f"Жеребьёвки: вручную {DRAWS.get(kind='manual')}, автозапуском {DRAWS.get(kind='autorun')}\n"
+        f"Автозапуск: тактов {scheduler.ticks}, чатов в плане {len(scheduler)}\n"
+        f"Кэш упоминаний: {cache['size']} записей, попаданий {cache['hit_rate']:.0%}\n"
+        f"Очередь отправки: {queue['depth']} в очереди, отправлено {queue['sent']}, "
+        f"ошибок {queue['failed']}, p95 {queue['latency_p95']} с"
+    )
+
+@dp.message(Command("botstats"))
+async def botstats_cmd(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await reply(message, "Команда доступна только администраторам бота.")
+        return
+    await reply(message, build_botstats(), parse_mode="HTML")
+
 # ========== ЗАПУСК ===================
+# python victim_bot.py — запуск бота; python -m victim_bot export|import|backup —
+# работа с сохранённым состоянием (см. backup.py), токен для этого не нужен
 if __name__ == "__main__":
-    import asyncio
+    if len(sys.argv) > 1:
+        os.makedirs(config.DATA_DIR, exist_ok=True)
+        if sys.argv[1] == "import" and not FileLock(os.path.join(config.DATA_DIR, "process.lock")).acquire(blocking=False):
+            # Работающий бот держит состояние в памяти и перезаписал бы восстановленное
+            sys.exit(f"{config.DATA_DIR} занята работающим ботом — остановите его перед import")
+        # При шардировании import берёт из выгрузки только чаты своего шарда
+        sys.exit(backup.main(
+            sys.argv[1:], backend,
+            owns=owns_chat,
+        ))
+
+    if config.SHARD_COUNT > 1 and config.RUN_MODE != "webhook":
+        # getUpdates на один токен из нескольких процессов даёт 409, а
+        # апдейты чужих чатов, отброшенные процессом, никто другой не увидит
+        sys.exit("SHARD_COUNT > 1 работает только с RUN_MODE=webhook и маршрутизатором sharding.py")
+    if not 0 <= config.SHARD_INDEX < config.SHARD_COUNT:
+        sys.exit(f"SHARD_INDEX должен быть от 0 до {config.SHARD_COUNT - 1}")
 
     async def main():
+        started = time.perf_counter()
+        os.makedirs(config.DATA_DIR, exist_ok=True)
+        bot = get_bot()
+        # До чтения состояния: один живой процесс на папку данных шарда
+        data_dir_lock = await hold_data_dir(config.DATA_DIR)
+        # Разбор файлов и flock — вне event loop
+        await asyncio.to_thread(backend.load)
+        backend.start()
+        sender.start()
         await set_bot_commands(bot)
-        asyncio.create_task(autorun_scheduler())
-        logging.info("Бот стартует!")
-        await dp.start_polling(bot)
+        background = [
+            asyncio.create_task(scheduler_lease.hold(autorun_scheduler)),
+            asyncio.create_task(report_latency()),
+        ]
+        if config.METRICS_PORT:
+            await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+        logging.info(
+            f"Бот стартует! Режим: {config.RUN_MODE}, шард {config.SHARD_INDEX + 1}/{config.SHARD_COUNT}, "
+            f"подготовка {(time.perf_counter() - started) * 1000:.0f} мс"
+        )
+        allowed_updates = dp.resolve_used_update_types()
+        try:
+            if config.RUN_MODE == "webhook":
+                await run_webhook(
+                    dp, bot,
+                    url=config.WEBHOOK_URL,
+                    path=config.WEBHOOK_PATH,
+                    host=config.WEBHOOK_HOST,
+                    port=config.WEBHOOK_PORT,
+                    secret_token=config.WEBHOOK_SECRET,
+                    allowed_updates=allowed_updates,
+                    stats=webhook_latency,
+                )
+            else:
+                await dp.start_polling(bot, allowed_updates=allowed_updates)
+        finally:
+            # Сначала останавливаем автозапуск и дожидаемся его: иначе
+            # жеребьёвка могла бы записать состояние уже после сброса
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            await sender.close()
+            await backend.close()
+            data_dir_lock.release()
+            logging.info(f"Кэш упоминаний: {mention_cache.stats()}")
+            logging.info(f"Очередь отправки: {sender.stats()}")
 
     asyncio.run(main())
@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import time
+from collections import deque
+
+from aiohttp import ClientSession, web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# =============== ЗАМЕР ЗАДЕРЖЕК ==================
+class LatencyStats:
+    # Последние window замеров (секунды) и перцентили по ним
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def stats(self):
+        samples = sorted(self.samples)
+
+        def pct(p):
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(samples[-1] * 1000, 2) if samples else 0.0,
+        }
+
+def latency_middleware(stats):
+    @web.middleware
+    async def middleware(request, handler):
+        started = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            stats.record(time.perf_counter() - started)
+    return middleware
+
+# =============== ПРИЛОЖЕНИЕ ==================
+def build_app(dp, bot, path, secret_token=None, stats=None):
+    # Апдейты из POST-запросов попадают в тот же Dispatcher, что и при
+    # polling. Telegram получает ответ сразу, обработчики работают в фоне.
+    app = web.Application(middlewares=[latency_middleware(stats)] if stats else [])
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=secret_token or None,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook(dp, bot, url, path, host, port, secret_token=None, allowed_updates=None, stats=None):
+    app = build_app(dp, bot, path, secret_token, stats)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    if url:
+        await bot.set_webhook(
+            url.rstrip("/") + path,
+            secret_token=secret_token or None,
+            allowed_updates=allowed_updates,
+        )
+    logging.info(f"Webhook слушает {host}:{port}{path}")
+    # Как и start_polling, завершаемся по SIGTERM/SIGINT штатно: вызывающий
+    # код успевает сбросить состояние на диск (docker stop шлёт SIGTERM)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            signals.append(sig)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await stop.wait()
+        logging.info("Webhook: получен сигнал остановки")
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
+
+# =============== ЛОКАЛЬНАЯ ПРОВЕРКА ==================
+# python webhook.py updates.json --url http://127.0.0.1:8080/webhook --secret ...
+# Файл — JSON-массив апдейтов или по одному апдейту на строку.
+def read_updates(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+async def post_updates(updates, url, secret=None):
+    headers = {SECRET_HEADER: secret} if secret else {}
+    latencies = LatencyStats()
+    async with ClientSession() as session:
+        for update in updates:
+            started = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    logging.error(f"update {update.get('update_id')}: HTTP {resp.status}")
+            latencies.record(time.perf_counter() - started)
+    return latencies.stats()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправить записанные апдейты на локальный webhook")
+    parser.add_argument("file")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    print(json.dumps(asyncio.run(post_updates(read_updates(args.file), args.url, args.secret))))